@@ -7,7 +7,7 @@ import TrailDisplay from '@/components/TrailDisplay'
 import VibeOfTheDay from '@/components/VibeOfTheDay'
 import WelcomeModal from '@/components/WelcomeModal'
 import { VibeTrail } from '@/types'
-import { generateTrail } from '@/lib/api'
+import { generateTrail, getTrailOfTheDay } from '@/lib/api'
 import { getCurrentUser, saveTrail, getUserTrails } from '@/lib/supabase'
 
 interface User {
@@ -86,24 +86,8 @@ export default function Home() {
 
   const generateVibeOfTheDay = async (location: {lat: number, lng: number}) => {
     try {
-      // Use a rotating vibe of the day (you can make this more sophisticated)
-      const vibesOfTheDay = [
-        ['hidden', 'local'],
-        ['foodie', 'trendy'],
-        ['cozy', 'artsy'],
-        ['nature', 'historic'],
-        ['nightlife', 'vibrant']
-      ]
-      
-      const today = new Date()
-      const dayOfWeek = today.getDay()
-      const todaysVibes = vibesOfTheDay[dayOfWeek] || ['cozy', 'local']
-      
-      const trail = await generateTrail({
-        vibes: todaysVibes,
-        latitude: location.lat,
-        longitude: location.lng
-      })
+      // The backend rotates the vibe of the day and serves a precomputed trail for the area
+      const trail = await getTrailOfTheDay(location.lat, location.lng)
       
       setVibeOfTheDay(trail)
     } catch (error) {
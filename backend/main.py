@@ -1,13 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel, field_validator
+from typing import Optional, Union
 import os
+import json
+import asyncio
+import datetime
+import time
 from dotenv import load_dotenv
 from services.google_places import GooglePlacesService
 from services.trail_model import TrailModel
 from services.gemini_narrative import GeminiNarrativeService
 from services.supabase_service import SupabaseService
 from services.mapbox_directions import MapboxDirectionsService
+from services.candidate_pool import CandidatePoolStore
+from services.walking_estimator import WalkingEstimator
+from services.trail_of_the_day import TrailOfTheDayService
+from services import metrics
 
 # Load environment variables
 load_dotenv()
@@ -29,6 +39,9 @@ app.add_middleware(
 
 # Initialize services
 print("Initializing services...")
+# Offline walking estimates shared by trail planning and the directions fallback
+walking_estimator = WalkingEstimator()
+
 try:
     google_places = GooglePlacesService()
     print("✓ Google Places service initialized")
@@ -37,7 +50,7 @@ except Exception as e:
     google_places = None
 
 try:
-    trail_model = TrailModel()
+    trail_model = TrailModel(walking_estimator)
     print("✓ Trail model initialized")
 except Exception as e:
     print(f"⚠ Trail model failed: {e}")
@@ -58,27 +71,144 @@ except Exception as e:
     supabase = None
 
 try:
-    mapbox_directions = MapboxDirectionsService()
+    mapbox_directions = MapboxDirectionsService(walking_estimator)
     print("✓ Mapbox directions service initialized")
 except Exception as e:
     print(f"⚠ Mapbox directions service failed: {e}")
     mapbox_directions = None
 
+# Candidate pools behind generated trails, so stop regeneration skips Places calls
+candidate_pools = CandidatePoolStore()
+
+# Precomputed trails for the most requested (tile, vibe) pairs, refreshed in the background
+trail_of_the_day = TrailOfTheDayService(lambda vibes, lat, lng: _materialize_trail(vibes, lat, lng))
+# Serve single-vibe /generate-trail requests from the precomputed trails
+serve_trails_of_the_day = os.getenv('TRAIL_OF_THE_DAY_SERVE_GENERATE', 'false').lower() == 'true'
+
+# Reuse of saved trails by /generate-trail. Off by default: nothing publishes trails yet
+# and the backend queries with the anon key, so the search_trails RPC cannot return rows
+trail_reuse_enabled = os.getenv('TRAIL_REUSE_ENABLED', 'false').lower() == 'true'
+# How far from the user a saved trail may start to be reused
+trail_reuse_radius = float(os.getenv('TRAIL_REUSE_RADIUS_METERS', '800'))
+
+# Plan trails on Mapbox walking-matrix distances instead of the offline estimate (extra upstream calls)
+use_walking_matrix = os.getenv('TRAIL_USE_WALKING_MATRIX', 'false').lower() == 'true'
+
+def _cache_stats() -> dict:
+    """Hit/miss/entry counts of every in-process cache, keyed by cache name."""
+    stats = {"candidate_pools": candidate_pools.stats(), "trail_of_the_day": trail_of_the_day.stats()}
+    if google_places:
+        stats["places"] = google_places.cache.stats()
+        stats["places_tile_radius"] = google_places.tile_radius_stats()
+    if mapbox_directions:
+        stats["mapbox_routes"] = mapbox_directions.route_cache.stats()
+        stats["mapbox_legs"] = mapbox_directions.leg_cache.stats()
+        stats["mapbox_matrix"] = mapbox_directions.matrix_cache.stats()
+    if gemini_narrative:
+        stats["narratives"] = gemini_narrative.cache.stats()
+    return stats
+
+def _single_flight_stats() -> dict:
+    """Coalescing counts of every service that deduplicates upstream calls."""
+    coalescing_services = {
+        "google_places": google_places,
+        "mapbox": mapbox_directions,
+        "gemini": gemini_narrative,
+        "trail_of_the_day": trail_of_the_day
+    }
+    return {name: service.single_flight.stats() for name, service in coalescing_services.items() if service}
+
+# Metrics read from the services' own counters at scrape time
+metrics.REGISTRY.counter("localvibe_cache_hits_total", "Cache hits.", ("cache",),
+                         callback=lambda: {(name,): stats.get("hits", 0) for name, stats in _cache_stats().items()})
+metrics.REGISTRY.counter("localvibe_cache_misses_total", "Cache misses.", ("cache",),
+                         callback=lambda: {(name,): stats.get("misses", 0) for name, stats in _cache_stats().items()})
+metrics.REGISTRY.gauge("localvibe_cache_entries", "Entries held per cache.", ("cache",),
+                       callback=lambda: {(name,): stats["entries"] for name, stats in _cache_stats().items() if "entries" in stats})
+metrics.REGISTRY.counter("localvibe_single_flight_calls_total", "Upstream calls actually made.", ("service",),
+                         callback=lambda: {(name,): stats["calls"] for name, stats in _single_flight_stats().items()})
+metrics.REGISTRY.counter("localvibe_single_flight_coalesced_total", "Calls served by an identical in-flight call.", ("service",),
+                         callback=lambda: {(name,): stats["coalesced"] for name, stats in _single_flight_stats().items()})
+metrics.REGISTRY.gauge("localvibe_single_flight_in_flight", "Distinct upstream calls in flight.", ("service",),
+                       callback=lambda: {(name,): stats["in_flight"] for name, stats in _single_flight_stats().items()})
+metrics.REGISTRY.gauge("localvibe_gemini_waiting", "Narrative calls waiting for a concurrency slot.",
+                       callback=lambda: {(): gemini_narrative.waiting} if gemini_narrative else {})
+metrics.REGISTRY.counter("localvibe_gemini_timeouts_total", "Narrative calls that timed out.",
+                         callback=lambda: {(): gemini_narrative.timeouts} if gemini_narrative else {})
+
 print("All services initialization completed!")
 
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Time every request, continue or start its trace, and echo the traceparent header."""
+    trace_token, traceparent = metrics.start_trace(request.headers.get("traceparent"))
+    metrics.HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        response.headers["traceparent"] = traceparent
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit():
+            metrics.HTTP_RESPONSE_BYTES.observe(int(content_length), route=_route_label(request))
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                             route=_route_label(request), status=status)
+        metrics.end_trace(trace_token)
+
+def _route_label(request: Request) -> str:
+    # The route template, not the raw path, keeps label cardinality bounded
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
 @app.on_event("startup")
 async def startup_event():
     print("FastAPI application is starting up...")
     print(f"Environment variables loaded: PORT={os.getenv('PORT', '8000')}")
+    
+    # Open long-lived, pooled upstream clients
+    if google_places:
+        await google_places.start()
+    if mapbox_directions:
+        await mapbox_directions.start()
+    if supabase:
+        await supabase.start()
+    await trail_of_the_day.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("FastAPI application is shutting down...")
+    
+    if google_places:
+        await google_places.close()
+    if mapbox_directions:
+        await mapbox_directions.close()
+    if supabase:
+        await supabase.close()
+    await trail_of_the_day.close()
+    if gemini_narrative:
+        gemini_narrative.close()
+
+# Vibe options offered to users (also the rotation for the trail of the day)
+AVAILABLE_VIBES = [
+    {"id": "cozy", "name": "Cozy & Quiet", "emoji": "☕", "description": "Peaceful spots for reflection and comfort"},
+    {"id": "artsy", "name": "Artsy & Creative", "emoji": "🎨", "description": "Creative spaces that inspire imagination"},
+    {"id": "historic", "name": "Historic & Classic", "emoji": "🏛️", "description": "Timeless places with rich stories"},
+    {"id": "trendy", "name": "Trendy & Modern", "emoji": "✨", "description": "Contemporary spots with cutting-edge vibes"},
+    {"id": "nature", "name": "Nature & Outdoors", "emoji": "🌳", "description": "Green spaces and outdoor adventures"},
+    {"id": "foodie", "name": "Foodie Paradise", "emoji": "🍽️", "description": "Culinary delights and unique dining experiences"},
+    {"id": "nightlife", "name": "Nightlife & Energy", "emoji": "🌙", "description": "Vibrant evening spots with great energy"},
+    {"id": "hidden", "name": "Hidden Gems", "emoji": "💎", "description": "Off-the-beaten-path discoveries"}
+]
 
 class TrailRequest(BaseModel):
     vibes: list[str]
     latitude: float
     longitude: float
+    reuse_existing: bool = False  # Serve a nearby saved trail with these vibes if one exists (needs TRAIL_REUSE_ENABLED)
 
 class RegenerateStopRequest(BaseModel):
     vibes: list[str]
@@ -86,10 +216,17 @@ class RegenerateStopRequest(BaseModel):
     longitude: float
     current_trail: dict
     stop_to_replace: int  # Index of the stop to replace
+    trail_token: Optional[str] = None  # Defaults to current_trail['trail_token']
 
 class TrailResponse(BaseModel):
     narrative: dict
     stops: list[dict]
+    route: Optional[dict] = None  # Visiting order and estimated walking distances
+    trail_token: Optional[str] = None  # Handle to the server-side candidate pool
+    reused_trail_id: Optional[str] = None  # Set when an existing saved trail was served
+
+class TrailOfTheDayResponse(TrailResponse):
+    vibe: str
 
 class RegenerateStopResponse(BaseModel):
     new_stop: dict
@@ -97,9 +234,20 @@ class RegenerateStopResponse(BaseModel):
 
 class DirectionsRequest(BaseModel):
     coordinates: list[dict]  # List of {"lat": float, "lng": float}
+    # Response payload options; the defaults keep the original full GeoJSON response
+    geometry_format: str = "geojson"  # "geojson" or "polyline6" (encoded polyline strings)
+    simplify_tolerance: Optional[float] = None  # Douglas-Peucker tolerance in meters
+    include_step_geometry: bool = True
+    
+    @field_validator('geometry_format')
+    @classmethod
+    def validate_geometry_format(cls, v):
+        if v not in ("geojson", "polyline6"):
+            raise ValueError("geometry_format must be 'geojson' or 'polyline6'")
+        return v
 
 class DirectionsResponse(BaseModel):
-    geometry: dict
+    geometry: Union[dict, str]  # GeoJSON LineString, or an encoded polyline6 string
     duration: int
     distance: int
     steps: list[dict]
@@ -117,6 +265,11 @@ class DirectionsResponse(BaseModel):
 async def root():
     return {"message": "LocalVibe API is running! 🗺️"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics in the text exposition format."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for Railway and other deployment platforms"""
@@ -134,6 +287,14 @@ async def health_check():
             "message": "LocalVibe API is running",
             "version": "1.0.0",
             "services": services_status,
+            "narrative": gemini_narrative.stats() if gemini_narrative else None,
+            "candidate_pools": candidate_pools.stats(),
+            "trail_of_the_day": trail_of_the_day.stats(),
+            "coalescing": {
+                "google_places": google_places.single_flight.stats() if google_places else None,
+                "mapbox_directions": mapbox_directions.single_flight.stats() if mapbox_directions else None,
+                "gemini": gemini_narrative.single_flight.stats() if gemini_narrative else None
+            },
             "port": os.getenv('PORT', '8000')
         }
     except Exception as e:
@@ -152,46 +313,90 @@ async def generate_trail(request: TrailRequest):
     try:
         print(f"Received request for vibes: {request.vibes} at location: {request.latitude}, {request.longitude}")
         
-        # 1. Fetch candidate places from Google Places API
-        candidate_places = await google_places.get_places_by_vibe(
-            request.vibes, 
-            request.latitude, 
-            request.longitude
-        )
-        
-        if not candidate_places:
-            raise HTTPException(status_code=404, detail="No places found for the selected vibes")
-        
-        print(f"Found {len(candidate_places)} candidate places")
-        
-        # 2. Use our in-house model to score, rank, and select the best 3-4 places
-        selected_stops = trail_model.score_and_select_pois(
-            candidate_places, 
-            request.vibes
-        )
+        # 0. Optionally reuse an existing trail instead of generating one
+        if request.reuse_existing and trail_reuse_enabled:
+            with metrics.stage('trail_reuse'):
+                existing_trail = await _find_reusable_trail(request)
+            if existing_trail:
+                print(f"Reusing saved trail {existing_trail['reused_trail_id']}")
+                return existing_trail
         
-        print(f"Selected {len(selected_stops)} stops for the trail")
+        # Single-vibe requests are the most common shape; serve the tile's precomputed trail
+        trail_of_the_day.record_request(request.latitude, request.longitude, request.vibes)
+        if serve_trails_of_the_day and len(request.vibes) == 1:
+            cached = trail_of_the_day.get_cached(request.latitude, request.longitude, request.vibes[0])
+            if cached:
+                print(f"Serving precomputed trail for {request.vibes[0]}")
+                return cached[0]
         
-        # 3. Use Gemini API to generate a narrative for the selected stops
-        trail_narrative = await gemini_narrative.generate_narrative(
-            vibes=request.vibes, 
-            stops=selected_stops,
-            city="Brooklyn"  # This could be determined from coordinates
-        )
+        # 1-3. Candidate places, stop selection and narrative
+        trail = await _generate_trail(request.vibes, request.latitude, request.longitude)
+        if not trail:
+            raise HTTPException(status_code=404, detail="No places found for the selected vibes")
         
-        print(f"Generated narrative: {trail_narrative}")
+        return trail
         
-        # 4. Combine and return the final trail object
-        trail_response = {
-            "narrative": trail_narrative,
-            "stops": selected_stops
-        }
+    except Exception as e:
+        print(f"Error generating trail: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to generate trail: {str(e)}")
+
+@app.post("/generate-trail/stream")
+async def generate_trail_stream(request: TrailRequest):
+    """
+    Streaming variant of /generate-trail that returns newline-delimited JSON events.
+    
+    The selected stops are sent as soon as they are scored; the narrative and the
+    walking route are then generated concurrently and each is sent as it completes.
+    Events: {"event": "stops"}, {"event": "narrative"}, {"event": "directions"},
+    {"event": "error"} and a final {"event": "done"}.
+    """
+    try:
+        print(f"Received streaming request for vibes: {request.vibes} at location: {request.latitude}, {request.longitude}")
+        trail_of_the_day.record_request(request.latitude, request.longitude, request.vibes)
         
-        return trail_response
+        selection = await _select_stops(request.vibes, request.latitude, request.longitude)
+        if not selection:
+            raise HTTPException(status_code=404, detail="No places found for the selected vibes")
+        selected_stops = selection['stops']
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating trail: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate trail: {str(e)}")
+    
+    async def narrative_event():
+        narrative = await _write_narrative(request.vibes, selected_stops)
+        return {"event": "narrative", "narrative": narrative}
+    
+    async def directions_event():
+        coordinates = [stop['geometry']['location'] for stop in selected_stops]
+        with metrics.stage('directions'):
+            directions = await mapbox_directions.get_walking_directions(coordinates)
+        if not directions:
+            return {"event": "directions", "directions": None}
+        return {"event": "directions", "directions": _format_directions(directions).model_dump()}
+    
+    async def event_stream():
+        yield json.dumps({"event": "stops", **selection}) + "\n"
+        
+        tasks = [asyncio.create_task(narrative_event()), asyncio.create_task(directions_event())]
+        try:
+            for next_event in asyncio.as_completed(tasks):
+                try:
+                    event = await next_event
+                except Exception as e:
+                    print(f"Error in streamed trail generation: {str(e)}")
+                    event = {"event": "error", "detail": str(e)}
+                yield json.dumps(event) + "\n"
+        finally:
+            # Client disconnected before both results were sent
+            for task in tasks:
+                task.cancel()
+        
+        yield json.dumps({"event": "done"}) + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
 
 @app.post("/regenerate-stop", response_model=RegenerateStopResponse)
 async def regenerate_stop(request: RegenerateStopRequest):
@@ -201,23 +406,32 @@ async def regenerate_stop(request: RegenerateStopRequest):
     try:
         print(f"Regenerating stop {request.stop_to_replace} for vibes: {request.vibes}")
         
-        # 1. Fetch fresh candidate places
-        candidate_places = await google_places.get_places_by_vibe(
-            request.vibes, 
-            request.latitude, 
-            request.longitude
-        )
+        # 1. Reuse the trail's candidate pool, or fetch fresh candidate places
+        trail_token = request.trail_token or request.current_trail.get('trail_token')
+        pool = candidate_pools.get(trail_token, request.vibes)
+        if pool:
+            candidate_places = pool['places']
+        else:
+            with metrics.stage('places'):
+                candidate_places = await google_places.get_places_by_vibe(
+                    request.vibes, 
+                    request.latitude, 
+                    request.longitude
+                )
+            trail_token = candidate_pools.save(candidate_places, request.vibes) if candidate_places else None
         
         if not candidate_places:
             raise HTTPException(status_code=404, detail="No places found for the selected vibes")
         
         # 2. Get alternative stops for the specific position
-        alternative_stops = trail_model.get_alternative_stops(
-            candidate_places,
-            request.vibes,
-            request.current_trail,
-            request.stop_to_replace
-        )
+        with metrics.stage('trail_planning'):
+            alternative_stops = trail_model.get_alternative_stops(
+                candidate_places,
+                request.vibes,
+                request.current_trail,
+                request.stop_to_replace,
+                origin=(request.latitude, request.longitude)
+            )
         
         if not alternative_stops:
             raise HTTPException(status_code=404, detail="No alternative stops found")
@@ -226,15 +440,22 @@ async def regenerate_stop(request: RegenerateStopRequest):
         new_stop = alternative_stops[0]  # Get the best alternative
         
         # 4. Create updated trail
+        previous_stops = request.current_trail['stops']
         updated_trail = request.current_trail.copy()
+        updated_trail['stops'] = list(previous_stops)
         updated_trail['stops'][request.stop_to_replace] = new_stop
+        updated_trail['route'] = await _route_summary(updated_trail['stops'])
+        updated_trail['trail_token'] = trail_token
         
-        # 5. Regenerate narrative for the updated trail
-        updated_narrative = await gemini_narrative.generate_narrative(
-            vibes=request.vibes,
-            stops=updated_trail['stops'],
-            city="Brooklyn"
-        )
+        # 5. Revise the narrative for the updated trail, reusing it when the trail's character is unchanged
+        with metrics.stage('narrative'):
+            updated_narrative = await gemini_narrative.revise_narrative(
+                vibes=request.vibes,
+                previous_stops=previous_stops,
+                stops=updated_trail['stops'],
+                previous_narrative=request.current_trail.get('narrative'),
+                city="Brooklyn"
+            )
         
         updated_trail['narrative'] = updated_narrative
         
@@ -250,17 +471,37 @@ async def regenerate_stop(request: RegenerateStopRequest):
 @app.get("/vibes")
 async def get_available_vibes():
     """Get all available vibe options"""
-    vibes = [
-        {"id": "cozy", "name": "Cozy & Quiet", "emoji": "☕", "description": "Peaceful spots for reflection and comfort"},
-        {"id": "artsy", "name": "Artsy & Creative", "emoji": "🎨", "description": "Creative spaces that inspire imagination"},
-        {"id": "historic", "name": "Historic & Classic", "emoji": "🏛️", "description": "Timeless places with rich stories"},
-        {"id": "trendy", "name": "Trendy & Modern", "emoji": "✨", "description": "Contemporary spots with cutting-edge vibes"},
-        {"id": "nature", "name": "Nature & Outdoors", "emoji": "🌳", "description": "Green spaces and outdoor adventures"},
-        {"id": "foodie", "name": "Foodie Paradise", "emoji": "🍽️", "description": "Culinary delights and unique dining experiences"},
-        {"id": "nightlife", "name": "Nightlife & Energy", "emoji": "🌙", "description": "Vibrant evening spots with great energy"},
-        {"id": "hidden", "name": "Hidden Gems", "emoji": "💎", "description": "Off-the-beaten-path discoveries"}
-    ]
-    return {"vibes": vibes}
+    return {"vibes": AVAILABLE_VIBES}
+
+@app.get("/trail-of-the-day", response_model=TrailOfTheDayResponse)
+async def get_trail_of_the_day(latitude: float, longitude: float, vibe: Optional[str] = None):
+    """
+    Get the precomputed trail of the day for the area around a location.
+    
+    Without a vibe, the vibe of the day rotates daily through the available vibes.
+    Trails are served from the precomputed store (stale ones are refreshed in the
+    background) and generated on the spot only when the area has none yet; such
+    trails are kept in a small on-demand store unless the area is in demand.
+    """
+    if vibe is None:
+        vibe = AVAILABLE_VIBES[datetime.date.today().toordinal() % len(AVAILABLE_VIBES)]["id"]
+    elif vibe not in {option["id"] for option in AVAILABLE_VIBES}:
+        # Unknown vibes would run the full pipeline and fill the store with junk keys
+        raise HTTPException(status_code=400, detail=f"Unknown vibe: {vibe}")
+    
+    # Homepage traffic counts towards which areas get precomputed
+    trail_of_the_day.record_request(latitude, longitude, [vibe])
+    
+    try:
+        trail = await trail_of_the_day.get_trail(latitude, longitude, vibe)
+    except Exception as e:
+        print(f"Error getting trail of the day: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get trail of the day: {str(e)}")
+    
+    if not trail:
+        raise HTTPException(status_code=404, detail="No trail of the day available for this area")
+    
+    return {**trail, "vibe": vibe}
 
 @app.post("/directions", response_model=DirectionsResponse)
 async def get_walking_directions(request: DirectionsRequest):
@@ -271,24 +512,136 @@ async def get_walking_directions(request: DirectionsRequest):
         print(f"Getting directions for {len(request.coordinates)} coordinates")
         
         # Get directions from Mapbox
-        directions = await mapbox_directions.get_walking_directions(request.coordinates)
+        with metrics.stage('directions'):
+            directions = await mapbox_directions.get_walking_directions(request.coordinates)
         
         if not directions:
             raise HTTPException(status_code=404, detail="No directions found for the given coordinates")
         
-        return DirectionsResponse(
-            geometry=directions["geometry"],
-            duration=directions["duration"],
-            distance=directions["distance"],
-            steps=directions["steps"],
-            formatted_duration=mapbox_directions.format_duration(directions["duration"]),
-            formatted_distance=mapbox_directions.format_distance(directions["distance"])
+        return _format_directions(
+            directions,
+            geometry_format=request.geometry_format,
+            simplify_tolerance=request.simplify_tolerance,
+            include_step_geometry=request.include_step_geometry
         )
         
     except Exception as e:
         print(f"Error getting directions: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get directions: {str(e)}")
 
+async def _select_stops(vibes: list, latitude: float, longitude: float, save_pool: bool = True) -> Optional[dict]:
+    """
+    Fetch candidate places and plan the trail's stops and route, or None if nothing was found.
+    With `save_pool`, the candidates are kept for /regenerate-stop under the returned trail token.
+    """
+    # 1. Fetch candidate places from Google Places API
+    with metrics.stage('places'):
+        candidate_places = await google_places.get_places_by_vibe(vibes, latitude, longitude)
+    if not candidate_places:
+        return None
+    
+    print(f"Found {len(candidate_places)} candidate places")
+    
+    # 2. Use our in-house model to score, rank, and select the best 3-4 places
+    #    and order them into the shortest walk
+    with metrics.stage('trail_planning'):
+        trail_plan = await _plan_trail(candidate_places, vibes, origin=(latitude, longitude))
+    if not trail_plan['stops']:
+        return None
+    
+    print(f"Selected {len(trail_plan['stops'])} stops for the trail")
+    
+    return {
+        "stops": trail_plan['stops'],
+        "route": trail_plan['route'],
+        "trail_token": candidate_pools.save(candidate_places, vibes) if save_pool else None
+    }
+
+async def _write_narrative(vibes: list, stops: list) -> dict:
+    """Use Gemini API to generate a narrative for the selected stops."""
+    with metrics.stage('narrative'):
+        return await gemini_narrative.generate_narrative(
+            vibes=vibes,
+            stops=stops,
+            city="Brooklyn"  # This could be determined from coordinates
+        )
+
+async def _generate_trail(vibes: list, latitude: float, longitude: float, save_pool: bool = True) -> Optional[dict]:
+    """The full Places -> scoring -> narrative pipeline, shaped like a /generate-trail response."""
+    selection = await _select_stops(vibes, latitude, longitude, save_pool)
+    if not selection:
+        return None
+    
+    trail_narrative = await _write_narrative(vibes, selection['stops'])
+    print(f"Generated narrative: {trail_narrative}")
+    
+    return {"narrative": trail_narrative, **selection}
+
+async def _materialize_trail(vibes: list, latitude: float, longitude: float) -> Optional[dict]:
+    """Generate a precomputed trail. Candidate pools expire long before it does, so none is kept."""
+    return await _generate_trail(vibes, latitude, longitude, save_pool=False)
+
+async def _find_reusable_trail(request: TrailRequest) -> Optional[dict]:
+    """A nearby saved trail covering all requested vibes, shaped like a /generate-trail response."""
+    if not supabase:
+        return None
+    
+    candidates = await supabase.search_trails(request.vibes, request.latitude, request.longitude, radius_m=trail_reuse_radius)
+    for candidate in candidates:
+        trail_data = candidate.get('trail_data') or {}
+        if set(request.vibes) <= set(candidate.get('vibes') or []) and trail_data.get('narrative') and trail_data.get('stops'):
+            return {
+                "narrative": trail_data['narrative'],
+                "stops": trail_data['stops'],
+                "route": trail_data.get('route'),
+                "trail_token": None,  # /regenerate-stop fetches a fresh candidate pool
+                "reused_trail_id": candidate['id']
+            }
+    return None
+
+async def _plan_trail(candidate_places: list, vibes: list, origin: tuple) -> dict:
+    """Plan a trail, on Mapbox walking-matrix distances when enabled, else on the offline estimator."""
+    distance_matrix = None
+    if use_walking_matrix and mapbox_directions:
+        pool = trail_model.candidate_pool(candidate_places, vibes, origin)
+        points = [place.get('geometry', {}).get('location', {}) for place in pool]
+        with metrics.stage('walking_matrix'):
+            matrix = await mapbox_directions.get_walking_matrix(points)
+        distance_matrix = matrix['distances']
+    elif walking_estimator.has_graph:
+        pool = trail_model.candidate_pool(candidate_places, vibes, origin)
+        points = [place.get('geometry', {}).get('location', {}) for place in pool]
+        lats = [point.get('lat', float('nan')) for point in points]
+        lngs = [point.get('lng', float('nan')) for point in points]
+        # Graph routing is CPU-bound (capped by WALKING_GRAPH_MATRIX_BUDGET_MS); keep it off the event loop
+        with metrics.stage('walking_matrix'):
+            loop = asyncio.get_running_loop()
+            distance_matrix = await loop.run_in_executor(None, walking_estimator.distance_matrix, lats, lngs)
+    
+    return trail_model.plan_trail(candidate_places, vibes, origin=origin, distance_matrix=distance_matrix)
+
+async def _route_summary(stops: list) -> dict:
+    """Route summary for stops in their given order, off the event loop when graph routing is used."""
+    if walking_estimator.has_graph:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, trail_model.route_summary, stops)
+    return trail_model.route_summary(stops)
+
+def _format_directions(directions: dict, geometry_format: str = "geojson", simplify_tolerance: Optional[float] = None,
+                       include_step_geometry: bool = True) -> DirectionsResponse:
+    """Shape a MapboxDirectionsService result into the public directions response."""
+    if geometry_format != "geojson" or simplify_tolerance or not include_step_geometry:
+        directions = mapbox_directions.compact_directions(directions, geometry_format, simplify_tolerance, include_step_geometry)
+    
+    return DirectionsResponse(
+        geometry=directions["geometry"],
+        duration=directions["duration"],
+        distance=directions["distance"],
+        steps=directions["steps"],
+        formatted_duration=mapbox_directions.format_duration(directions["duration"]),
+        formatted_distance=mapbox_directions.format_distance(directions["distance"])
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
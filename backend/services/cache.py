@@ -0,0 +1,174 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    In-process cache with per-entry TTL and LRU eviction.
+
+    Entries expire `ttl` seconds after being written; once `max_entries` is
+    reached the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def save(self, path: str):
+        """Persist unexpired entries to a JSON file (keys must be strings)."""
+        now = time.time()
+        entries = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        """Load entries written by `save`, skipping any that have expired."""
+        if not os.path.exists(path):
+            return
+
+        with open(path) as f:
+            entries = json.load(f)
+
+        now = time.time()
+        for key, expires_at, value in entries:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class CacheBackend:
+    """Async key/value cache interface shared by the in-process and Redis backends."""
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Per-worker cache backed by a TTLCache."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.cache.set(key, value, ttl)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Shared cache for multi-worker deployments, stored as JSON in Redis.
+
+    TTLs are set per key; LRU eviction is delegated to the Redis server's
+    `maxmemory-policy` (e.g. `allkeys-lru`).
+    """
+
+    def __init__(self, url: str, prefix: str, ttl: float = 3600):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self.client.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            print(f"Error reading from Redis cache: {e}")
+            raw = None
+
+        if raw is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        try:
+            await self.client.set(
+                f"{self.prefix}:{key}",
+                json.dumps(value),
+                ex=int(self.ttl if ttl is None else ttl)
+            )
+        except Exception as e:
+            print(f"Error writing to Redis cache: {e}")
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_cache_backend(prefix: str, max_entries: int, ttl: float, redis_url: Optional[str] = None) -> CacheBackend:
+    """Build the Redis backend when a URL is configured, else an in-process one."""
+    if redis_url:
+        try:
+            return RedisCacheBackend(redis_url, prefix=prefix, ttl=ttl)
+        except Exception as e:
+            print(f"Warning: Redis cache unavailable ({e}), falling back to in-process cache")
+
+    return InMemoryCacheBackend(max_entries=max_entries, ttl=ttl)
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+
+class CandidatePoolStore:
+    """
+    Server-side store of the candidate places behind each generated trail.
+
+    /generate-trail saves its candidate pool under a trail token so that
+    /regenerate-stop can draw alternatives without calling Google Places again.
+    Pools expire after a TTL and the least recently used ones are evicted once
+    the entry count or the approximate memory cap is exceeded.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv('TRAIL_POOL_TTL', '1800'))
+        self.max_entries = int(os.getenv('TRAIL_POOL_MAX_ENTRIES', '2000'))
+        self.max_bytes = int(os.getenv('TRAIL_POOL_MAX_BYTES', str(64 * 1024 * 1024)))
+
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pools: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+
+    def save(self, places: List[Dict[str, Any]], vibes: List[str]) -> str:
+        """Store a candidate pool and return its trail token."""
+        token = uuid.uuid4().hex
+        pool = {'places': places, 'vibes': list(vibes)}
+
+        # JSON length is a cheap, stable approximation of the pool's memory footprint
+        size = len(json.dumps(places, default=str))
+        self._pools[token] = (time.time() + self.ttl, size, pool)
+        self.total_bytes += size
+
+        while self._pools and (len(self._pools) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._evict_oldest()
+
+        return token
+
+    def get(self, token: Optional[str], vibes: List[str]) -> Optional[Dict[str, Any]]:
+        """Return the pool for a token if it exists, is fresh and was built for the same vibes."""
+        entry = self._pools.get(token) if token else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, size, pool = entry
+        if expires_at <= time.time():
+            self._remove(token)
+            self.misses += 1
+            return None
+
+        if sorted(pool['vibes']) != sorted(vibes):
+            self.misses += 1
+            return None
+
+        self._pools.move_to_end(token)
+        self.hits += 1
+        return pool
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._pools),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def _evict_oldest(self):
+        token = next(iter(self._pools))
+        self._remove(token)
+
+    def _remove(self, token: str):
+        _, size, _ = self._pools.pop(token)
+        self.total_bytes -= size
@@ -1,13 +1,25 @@
 import os
 import google.generativeai as genai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
+import asyncio
+import hashlib
+from collections import Counter
+from .cache import TTLCache
+from .single_flight import SingleFlight
+from .metrics import upstream_call
 
 class GeminiNarrativeService:
     """
     Service for generating AI-powered narratives for Vibe Trails using Google Gemini API.
     """
     
+    # Bump whenever _create_narrative_prompt changes so cached narratives are not reused
+    PROMPT_VERSION = 1
+    
+    # Types too generic to describe what a trail is about
+    GENERIC_TYPES = {'establishment', 'point_of_interest', 'store', 'food'}
+    
     def __init__(self):
         from dotenv import load_dotenv
         load_dotenv()
@@ -19,6 +31,39 @@ class GeminiNarrativeService:
         else:
             print("Warning: GOOGLE_GEMINI_API_KEY not found in environment variables")
             self.model = None
+        
+        # Narrative calls go through the SDK's async API, bounded by a
+        # concurrency cap and a per-call timeout
+        self.max_concurrency = int(os.getenv('GEMINI_MAX_CONCURRENCY', '16'))
+        self.request_timeout = float(os.getenv('GEMINI_TIMEOUT', '20'))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        self.in_flight = 0
+        self.waiting = 0
+        self.timeouts = 0
+        
+        # Identical prompts already in flight share one Gemini call
+        self.single_flight = SingleFlight()
+        
+        # Narratives are cached by a hash of (vibes, stop place_ids, city, prompt version)
+        self.cache = TTLCache(
+            max_entries=int(os.getenv('NARRATIVE_CACHE_MAX_ENTRIES', '4096')),
+            ttl=float(os.getenv('NARRATIVE_CACHE_TTL', '86400'))
+        )
+        self.cache_path = os.getenv('NARRATIVE_CACHE_PATH')
+        if self.cache_path:
+            try:
+                self.cache.load(self.cache_path)
+            except Exception as e:
+                print(f"Warning: Failed to load narrative cache from {self.cache_path}: {e}")
+    
+    def close(self):
+        """Persist the narrative cache to disk if a cache path is configured."""
+        if self.cache_path:
+            try:
+                self.cache.save(self.cache_path)
+            except Exception as e:
+                print(f"Warning: Failed to save narrative cache to {self.cache_path}: {e}")
     
     async def generate_narrative(self, vibes: List[str], stops: List[Dict[str, Any]], city: str = "Brooklyn") -> Dict[str, str]:
         """
@@ -36,6 +81,11 @@ class GeminiNarrativeService:
             # Return mock narrative if Gemini is not available
             return self._generate_mock_narrative(vibes, stops, city)
         
+        cache_key = self._narrative_cache_key(vibes, stops, city)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
         try:
             # Create the prompt for Gemini
             prompt = self._create_narrative_prompt(vibes, stops, city)
@@ -43,16 +93,117 @@ class GeminiNarrativeService:
             # Generate response from Gemini
             response = await self._generate_with_gemini(prompt)
             
-            # Parse and validate the response
+            # Parse and validate the response; unusable replies are not cached, so the next request retries
             narrative = self._parse_gemini_response(response)
+            if narrative is None:
+                return self._generate_mock_narrative(vibes, stops, city)
             
-            return narrative
+            self.cache.set(cache_key, narrative)
+            return dict(narrative)
             
         except Exception as e:
             print(f"Error generating narrative with Gemini: {e}")
             # Fallback to mock narrative
             return self._generate_mock_narrative(vibes, stops, city)
     
+    async def revise_narrative(self, vibes: List[str], previous_stops: List[Dict[str, Any]], stops: List[Dict[str, Any]],
+                               previous_narrative: Dict[str, str], city: str = "Brooklyn") -> Dict[str, str]:
+        """
+        Update a trail narrative after one of its stops has been replaced.
+        
+        If the new stop set keeps the same dominant place type, the previous
+        narrative still fits and is reused as-is; otherwise Gemini gets a short
+        revise prompt instead of the full narrative prompt. The previous narrative
+        is taken from the cache when the server wrote it; the client's copy is only
+        a fallback, and results based on it are never cached (the cache is shared).
+        
+        Args:
+            vibes: List of selected vibe tags
+            previous_stops: Stops the previous narrative was written for
+            stops: Stops after the replacement
+            previous_narrative: Dictionary with 'title' and 'description' keys
+            city: City name for context
+            
+        Returns:
+            Dictionary with 'title' and 'description' keys
+        """
+        if not previous_narrative or 'title' not in previous_narrative or 'description' not in previous_narrative:
+            return await self.generate_narrative(vibes, stops, city)
+        
+        cache_key = self._narrative_cache_key(vibes, stops, city)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        server_narrative = self.cache.get(self._narrative_cache_key(vibes, previous_stops, city))
+        trusted = server_narrative is not None
+        if trusted:
+            previous_narrative = dict(server_narrative)
+        else:
+            previous_narrative = {
+                'title': previous_narrative['title'],
+                'description': previous_narrative['description']
+            }
+        
+        if self._dominant_type(previous_stops) == self._dominant_type(stops) or not self.model:
+            if trusted:
+                self.cache.set(cache_key, previous_narrative)
+            return dict(previous_narrative)
+        
+        try:
+            prompt = self._create_revision_prompt(vibes, previous_stops, stops, previous_narrative, city)
+            response = await self._generate_with_gemini(prompt)
+            narrative = self._parse_gemini_response(response)
+            if narrative is None:
+                return previous_narrative
+            
+            if trusted:
+                self.cache.set(cache_key, narrative)
+            return dict(narrative)
+            
+        except Exception as e:
+            print(f"Error revising narrative with Gemini: {e}")
+            # The previous narrative is a better fallback than a generic one
+            return previous_narrative
+    
+    def _dominant_type(self, stops: List[Dict[str, Any]]) -> str:
+        """Most common specific place type across the stops (first seen wins ties)."""
+        type_counts = Counter(
+            place_type
+            for stop in stops
+            for place_type in stop.get('types', [])
+            if place_type not in self.GENERIC_TYPES
+        )
+        return type_counts.most_common(1)[0][0] if type_counts else ''
+    
+    def _create_revision_prompt(self, vibes: List[str], previous_stops: List[Dict[str, Any]], stops: List[Dict[str, Any]],
+                                previous_narrative: Dict[str, str], city: str) -> str:
+        """Create a short prompt asking Gemini to adapt an existing narrative to a changed stop."""
+        previous_names = {stop.get('name') for stop in previous_stops}
+        current_names = {stop.get('name') for stop in stops}
+        removed = ", ".join(sorted(name for name in previous_names - current_names if name)) or "none"
+        added = ", ".join(
+            f"{stop['name']} ({', '.join(stop.get('types', []))})"
+            for stop in stops
+            if stop.get('name') not in previous_names
+        ) or "none"
+        
+        return f"""
+        Revise this {city} "Vibe Trail" narrative ({', '.join(vibes)} vibes) after a stop change.
+        Removed stop: {removed}
+        Added stop: {added}
+        Current title: {previous_narrative['title']}
+        Current description: {previous_narrative['description']}
+        Keep the same tone, a title of max 8 words and a description of max 150 characters.
+        Respond only with JSON: {{"title": "...", "description": "..."}}
+        """
+    
+    def _narrative_cache_key(self, vibes: List[str], stops: List[Dict[str, Any]], city: str) -> str:
+        """Canonical hash of everything that determines the narrative prompt."""
+        stop_ids = [stop.get('place_id') or stop.get('name', '') for stop in stops]
+        payload = json.dumps([sorted(vibes), stop_ids, city, self.PROMPT_VERSION])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
     def _create_narrative_prompt(self, vibes: List[str], stops: List[Dict[str, Any]], city: str) -> str:
         """Create a detailed prompt for Gemini to generate the narrative."""
         
@@ -114,18 +265,51 @@ class GeminiNarrativeService:
         return prompt
     
     async def _generate_with_gemini(self, prompt: str) -> str:
-        """Generate response from Gemini API."""
+        """Generate response from Gemini API, sharing identical in-flight calls."""
+        prompt_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return await self.single_flight.do(prompt_key, lambda: self._call_gemini(prompt))
+    
+    async def _call_gemini(self, prompt: str) -> str:
+        """Call the Gemini API without blocking the event loop."""
         try:
-            # For async compatibility, we'll use a simple approach
-            # In production, you might want to use proper async Gemini client
-            response = self.model.generate_content(prompt)
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            
+            self.in_flight += 1
+            try:
+                # wait_for cancels the underlying request when the timeout expires
+                with upstream_call('gemini'):
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(prompt),
+                        timeout=self.request_timeout
+                    )
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+            
             return response.text
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            print(f"Gemini API call timed out after {self.request_timeout}s")
+            raise
         except Exception as e:
             print(f"Error calling Gemini API: {e}")
             raise e
     
-    def _parse_gemini_response(self, response: str) -> Dict[str, str]:
-        """Parse and validate the Gemini response."""
+    def stats(self) -> Dict[str, int]:
+        """Current narrative call concurrency, for health and monitoring."""
+        return {
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'timeouts': self.timeouts,
+            'max_concurrency': self.max_concurrency
+        }
+    
+    def _parse_gemini_response(self, response: str) -> Optional[Dict[str, str]]:
+        """Parse and validate the Gemini response, or None if it holds no usable narrative."""
         try:
             # Try to extract JSON from the response
             response_text = response.strip()
@@ -139,7 +323,7 @@ class GeminiNarrativeService:
                 narrative = json.loads(json_str)
                 
                 # Validate required fields
-                if 'title' in narrative and 'description' in narrative:
+                if isinstance(narrative, dict) and 'title' in narrative and 'description' in narrative:
                     return {
                         'title': narrative['title'].strip(),
                         'description': narrative['description'].strip()
@@ -150,17 +334,13 @@ class GeminiNarrativeService:
             
         except Exception as e:
             print(f"Error parsing Gemini response: {e}")
-            # Return a fallback narrative
-            return {
-                'title': 'Your Perfect Local Adventure',
-                'description': 'Discover amazing local spots that perfectly match your vibe and create unforgettable memories.'
-            }
+            return None
     
-    def _extract_narrative_manually(self, response: str) -> Dict[str, str]:
-        """Manually extract title and description if JSON parsing fails."""
+    def _extract_narrative_manually(self, response: str) -> Optional[Dict[str, str]]:
+        """Manually extract title and description if JSON parsing fails, or None if either is missing."""
         lines = response.split('\n')
-        title = "Your Perfect Local Adventure"
-        description = "Discover amazing local spots that perfectly match your vibe and create unforgettable memories."
+        title = None
+        description = None
         
         for line in lines:
             line = line.strip()
@@ -169,6 +349,9 @@ class GeminiNarrativeService:
             elif line.startswith('"description"') or line.startswith('description'):
                 description = line.split(':', 1)[1].strip().strip('"').strip(',')
         
+        if not title or not description:
+            print("Gemini response did not contain a usable narrative")
+            return None
         return {'title': title, 'description': description}
     
     def _generate_mock_narrative(self, vibes: List[str], stops: List[Dict[str, Any]], city: str) -> Dict[str, str]:
@@ -1,7 +1,13 @@
 import httpx
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import asyncio
+from .rate_limiter import TokenBucket
+from .cache import create_cache_backend, TTLCache
+from .geo import geohash_encode, geohash_center
+from .poi_store import PoiStore
+from .single_flight import SingleFlight
+from .metrics import InstrumentedTransport
 
 class GooglePlacesService:
     def __init__(self):
@@ -10,9 +16,87 @@ class GooglePlacesService:
         self.api_key = os.getenv('GOOGLE_MAPS_API_KEY')
         self.base_url = "https://maps.googleapis.com/maps/api/place"
         
+        # Fan-out settings: every (vibe, keyword) search runs concurrently,
+        # bounded by a concurrency cap and a token-bucket rate limit
+        self.max_concurrency = int(os.getenv('GOOGLE_PLACES_MAX_CONCURRENCY', '10'))
+        self.rate_limit = float(os.getenv('GOOGLE_PLACES_RATE_LIMIT', '20'))  # requests per second
+        self.request_timeout = float(os.getenv('GOOGLE_PLACES_TIMEOUT', '10'))
+        
+        self.client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._rate_limiter = TokenBucket(self.rate_limit)
+        
+        # Identical searches already in flight (e.g. users in the same tile) share one request
+        self.single_flight = SingleFlight()
+        
+        # Search results are cached per (geohash tile, keyword, radius, page) and every
+        # search in a tile is issued from the tile centre, so nearby users share entries
+        self.search_radius = 5000  # 5km default radius
+        self.cache_precision = int(os.getenv('PLACES_CACHE_GEOHASH_PRECISION', '6'))
+        self.cache = create_cache_backend(
+            prefix='places',
+            max_entries=int(os.getenv('PLACES_CACHE_MAX_ENTRIES', '2048')),
+            ttl=float(os.getenv('PLACES_CACHE_TTL', '3600')),
+            redis_url=os.getenv('PLACES_CACHE_REDIS_URL')
+        )
+        
+        # Optional local POI store fed by every live search; tiles harvested within
+        # the coverage TTL are answered from it without calling Google
+        self.poi_store: Optional[PoiStore] = None
+        poi_store_path = os.getenv('POI_STORE_PATH')
+        if poi_store_path:
+            try:
+                self.poi_store = PoiStore(
+                    poi_store_path,
+                    coverage_ttl=float(os.getenv('POI_STORE_COVERAGE_TTL', str(7 * 86400)))
+                )
+            except Exception as e:
+                print(f"Warning: Failed to open POI store at {poi_store_path}: {e}")
+        
+        # Adaptive harvesting: keywords are searched in waves until the pool is big
+        # and varied enough, then extra result pages, then a wider radius. The radius
+        # that worked for a tile is remembered and shrunk again where fresh results are
+        # dense; cached pages never shrink it, so a settled tile keeps hitting its cache.
+        self.target_pool_size = int(os.getenv('PLACES_TARGET_POOL_SIZE', '40'))
+        self.min_distinct_types = int(os.getenv('PLACES_MIN_DISTINCT_TYPES', '4'))
+        self.keywords_per_wave = int(os.getenv('PLACES_KEYWORDS_PER_WAVE', '2'))  # per vibe
+        self.min_radius = int(os.getenv('PLACES_MIN_RADIUS', '1000'))
+        self.max_radius = int(os.getenv('PLACES_MAX_RADIUS', '20000'))
+        self.max_pages = 3  # Google returns at most 3 pages of 20 results
+        self.page_token_delay = 2.0  # next_page_token takes a moment to become valid
+        # Page tokens expire long before cached pages do, so they are cached separately
+        self.page_token_ttl = float(os.getenv('PLACES_PAGE_TOKEN_TTL', '120'))
+        self._tile_radius = TTLCache(max_entries=4096, ttl=86400)
+        
         if not self.api_key:
             print("Warning: GOOGLE_MAPS_API_KEY not found in environment variables")
     
+    async def start(self):
+        """Create the shared, pooled HTTP client. Called from the app lifespan."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.request_timeout,
+                transport=InstrumentedTransport('google_places', httpx.AsyncHTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency
+                    )
+                ))
+            )
+    
+    async def close(self):
+        """Close the shared HTTP client and cache connections."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        await self.cache.close()
+        if self.poi_store is not None:
+            self.poi_store.close()
+    
+    def tile_radius_stats(self) -> Dict[str, int]:
+        """Hit/miss counts and size of the remembered per-tile search radii."""
+        return self._tile_radius.stats()
+    
     async def get_places_by_vibe(self, vibes: List[str], lat: float, lng: float) -> List[Dict[str, Any]]:
         """
         Fetch places from Google Places API based on selected vibes and location.
@@ -25,20 +109,14 @@ class GooglePlacesService:
             # Define vibe-specific search terms
             vibe_keywords = self._get_vibe_keywords(vibes)
             
-            # Fetch places for each vibe
-            all_places = []
-            for vibe, keywords in vibe_keywords.items():
-                places = await self._search_places(keywords, lat, lng)
-                all_places.extend(places)
-            
-            # Remove duplicates and return unique places
-            unique_places = self._deduplicate_places(all_places)
+            # Harvest a large enough, varied candidate pool
+            unique_places = await self._harvest_places(vibe_keywords, lat, lng)
             
             if len(unique_places) == 0:
                 # Fallback to mock data if no places found
                 return self._get_mock_places(vibes, lat, lng)
             
-            return unique_places[:20]  # Limit to top 20 results
+            return unique_places[:self.target_pool_size]
             
         except Exception as e:
             print(f"Error fetching places from Google Places API: {e}")
@@ -60,38 +138,227 @@ class GooglePlacesService:
         
         return {vibe: vibe_mapping.get(vibe, [vibe]) for vibe in vibes}
     
-    async def _search_places(self, keywords: List[str], lat: float, lng: float) -> List[Dict[str, Any]]:
-        """Search for places using Google Places API"""
-        places = []
-        
-        async with httpx.AsyncClient() as client:
-            for keyword in keywords:
-                try:
-                    # Nearby search
-                    url = f"{self.base_url}/nearbysearch/json"
-                    params = {
-                        'location': f"{lat},{lng}",
-                        'radius': '5000',  # 5km radius
-                        'keyword': keyword,
-                        'key': self.api_key,
-                        'type': 'establishment'
-                    }
-                    
-                    response = await client.get(url, params=params)
-                    response.raise_for_status()
-                    
-                    data = response.json()
-                    if data['status'] == 'OK':
-                        places.extend(data['results'])
-                    
-                    # Add small delay to respect API rate limits
-                    await asyncio.sleep(0.1)
-                    
-                except Exception as e:
-                    print(f"Error searching for keyword '{keyword}': {e}")
-                    continue
-        
-        return places
+    async def _harvest_places(self, vibe_keywords: Dict[str, List[str]], lat: float, lng: float) -> List[Dict[str, Any]]:
+        """
+        Collect candidates in stages, stopping as soon as the pool is sufficient.
+        
+        1. Keywords in waves, round-robin across vibes
+        2. Further result pages for keywords that have them
+        3. One retry of every keyword at twice the radius
+        
+        The pool interleaves results across keywords by rank, so truncating it
+        keeps the most prominent places of every keyword.
+        """
+        tile = geohash_encode(lat, lng, self.cache_precision)
+        radius = self._tile_radius.get(tile) or self.search_radius
+        
+        # Round-robin across vibes so every wave covers all of them
+        keyword_lists = list(vibe_keywords.values())
+        keywords = []
+        for rank in range(max((len(keyword_list) for keyword_list in keyword_lists), default=0)):
+            for keyword_list in keyword_lists:
+                if rank < len(keyword_list) and keyword_list[rank] not in keywords:
+                    keywords.append(keyword_list[rank])
+        
+        results: List[List[Dict[str, Any]]] = []
+        page_tokens: List[Optional[str]] = []
+        has_more: List[bool] = []
+        all_fresh = True  # every page so far came straight from Google
+        wave_size = max(1, self.keywords_per_wave * len(keyword_lists))
+        
+        # 1. Keyword waves
+        for start in range(0, len(keywords), wave_size):
+            pages = await self._search_places(keywords[start:start + wave_size], lat, lng, radius)
+            results.extend(page['results'] for page in pages)
+            page_tokens.extend(page.get('next_page_token') for page in pages)
+            has_more.extend(bool(page.get('has_more')) for page in pages)
+            all_fresh = all_fresh and all(page.get('fresh') for page in pages)
+            
+            pool = self._interleave_results(results)
+            if self._is_pool_sufficient(pool):
+                # Full fresh pages everywhere mean a dense area; search tighter next time.
+                # Shrinking on cache hits would move the tile off its cached radius.
+                if all_fresh and all(len(keyword_results) >= 20 for keyword_results in results):
+                    self._tile_radius.set(tile, max(self.min_radius, radius // 2))
+                return pool
+        
+        # 2. Further pages, only for keywords that have them
+        for page in range(1, self.max_pages):
+            # Cached pages can outlive their token; the next page may still be cached
+            pending = [i for i, token in enumerate(page_tokens) if token or has_more[i]]
+            if not pending:
+                break
+            
+            pages = await self._search_places(
+                [keywords[i] for i in pending], lat, lng, radius,
+                page_tokens=[page_tokens[i] for i in pending], page=page
+            )
+            for i, next_page in zip(pending, pages):
+                results[i] = results[i] + next_page['results']
+                page_tokens[i] = next_page.get('next_page_token')
+                has_more[i] = bool(next_page.get('has_more'))
+            
+            pool = self._interleave_results(results)
+            if self._is_pool_sufficient(pool):
+                return pool
+        
+        # 3. Sparse area: widen the search once and remember the radius for this tile
+        if radius < self.max_radius:
+            radius = min(self.max_radius, radius * 2)
+            self._tile_radius.set(tile, radius)
+            pages = await self._search_places(keywords, lat, lng, radius)
+            results = [keyword_results + page['results'] for keyword_results, page in zip(results, pages)]
+        
+        return self._interleave_results(results)
+    
+    def _interleave_results(self, results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Merge per-keyword result lists rank by rank, removing duplicates."""
+        merged = []
+        for rank in range(max((len(keyword_results) for keyword_results in results), default=0)):
+            for keyword_results in results:
+                if rank < len(keyword_results):
+                    merged.append(keyword_results[rank])
+        return self._deduplicate_places(merged)
+    
+    def _is_pool_sufficient(self, places: List[Dict[str, Any]]) -> bool:
+        """A pool is sufficient once it reaches the target size with enough distinct place types."""
+        if len(places) < self.target_pool_size:
+            return False
+        
+        primary_types = set()
+        for place in places:
+            specific_types = [place_type for place_type in place.get('types', []) if place_type not in ('establishment', 'point_of_interest')]
+            if specific_types:
+                primary_types.add(specific_types[0])
+        
+        return len(primary_types) >= self.min_distinct_types
+    
+    async def _search_places(self, keywords: List[str], lat: float, lng: float, radius: int,
+                             page_tokens: Optional[List[Optional[str]]] = None, page: int = 0) -> List[Dict[str, Any]]:
+        """Search for places using Google Places API, one concurrent request per keyword"""
+        page_tokens = page_tokens or [None] * len(keywords)
+        
+        if self.client is None:
+            # Service used outside the app lifespan (e.g. scripts) - use a short-lived client
+            async with httpx.AsyncClient(timeout=self.request_timeout, transport=InstrumentedTransport('google_places')) as client:
+                return await asyncio.gather(
+                    *[self._search_keyword(client, keyword, lat, lng, radius, token, page) for keyword, token in zip(keywords, page_tokens)]
+                )
+        
+        # Results keep keyword order, so deduplication stays deterministic
+        return await asyncio.gather(
+            *[self._search_keyword(self.client, keyword, lat, lng, radius, token, page) for keyword, token in zip(keywords, page_tokens)]
+        )
+    
+    async def _search_keyword(self, client: httpx.AsyncClient, keyword: str, lat: float, lng: float, radius: int,
+                              page_token: Optional[str] = None, page: int = 0, refresh: bool = False) -> Dict[str, Any]:
+        """
+        Fetch one page of a nearby search, served from the tile cache unless `refresh`.
+        
+        Returns a dictionary with 'results', 'has_more' and, while it is still cached,
+        'next_page_token' when more pages exist, and 'fresh' when the page was just
+        fetched from Google.
+        """
+        tile = geohash_encode(lat, lng, self.cache_precision)
+        cache_key = f"{tile}:{keyword}:{radius}:{page}"
+        
+        cached = None if refresh else await self.cache.get(cache_key)
+        if cached is not None:
+            if cached.get('has_more'):
+                return {**cached, 'next_page_token': await self.cache.get(f"{cache_key}:token")}
+            return cached
+        
+        if page > 0 and not page_token:
+            # The previous page's token expired; only the first page can be fetched again for a new one
+            if page > 1:
+                return {'results': []}
+            first_page = await self._search_keyword(client, keyword, lat, lng, radius, refresh=True)
+            page_token = first_page.get('next_page_token')
+            if not page_token:
+                return {'results': []}
+        
+        tile_lat, tile_lng = geohash_center(tile)
+        
+        # Recently harvested tiles are served from the local store (all pages at once)
+        if page == 0 and not refresh and self.poi_store is not None:
+            try:
+                places = await asyncio.get_running_loop().run_in_executor(
+                    None, self._query_store, tile, tile_lat, tile_lng, keyword, radius
+                )
+                if places is not None:
+                    result_page = {'results': places}
+                    await self.cache.set(cache_key, result_page)
+                    return result_page
+            except Exception as e:
+                print(f"Error reading POI store: {e}")
+        
+        return await self.single_flight.do(
+            cache_key,
+            lambda: self._fetch_page(client, cache_key, keyword, tile, radius, page_token, page)
+        )
+    
+    async def _fetch_page(self, client: httpx.AsyncClient, cache_key: str, keyword: str, tile: str, radius: int,
+                          page_token: Optional[str], page: int) -> Dict[str, Any]:
+        """Fetch one page of a nearby search from Google, centred on the tile."""
+        tile_lat, tile_lng = geohash_center(tile)
+        
+        try:
+            # Nearby search
+            url = f"{self.base_url}/nearbysearch/json"
+            if page_token:
+                params = {'pagetoken': page_token, 'key': self.api_key}
+                await asyncio.sleep(self.page_token_delay)
+            else:
+                params = {
+                    'location': f"{tile_lat},{tile_lng}",
+                    'radius': str(radius),
+                    'keyword': keyword,
+                    'key': self.api_key,
+                    'type': 'establishment'
+                }
+            
+            async with self._semaphore:
+                await self._rate_limiter.acquire()
+                response = await client.get(url, params=params)
+            response.raise_for_status()
+            
+            data = response.json()
+            if data['status'] not in ('OK', 'ZERO_RESULTS'):
+                return {'results': []}
+            
+            next_page_token = data.get('next_page_token')
+            result_page = {'results': data.get('results', []), 'has_more': bool(next_page_token)}
+            await self.cache.set(cache_key, result_page)
+            if next_page_token:
+                await self.cache.set(f"{cache_key}:token", next_page_token, ttl=self.page_token_ttl)
+            await self._store_results(tile, keyword, radius, page, result_page['results'])
+            return {**result_page, 'next_page_token': next_page_token, 'fresh': True}
+            
+        except Exception as e:
+            print(f"Error searching for keyword '{keyword}': {e}")
+            return {'results': []}
+    
+    def _query_store(self, tile: str, tile_lat: float, tile_lng: float, keyword: str, radius: int) -> Optional[List[Dict[str, Any]]]:
+        """Stored places for a covered tile, or None if it needs a live search. Blocking."""
+        if not self.poi_store.is_covered(tile, keyword, radius):
+            return None
+        return self.poi_store.query(tile_lat, tile_lng, radius, keyword=keyword)
+    
+    async def _store_results(self, tile: str, keyword: str, radius: int, page: int, places: List[Dict[str, Any]]):
+        """Feed live results into the local POI store; the first page marks the tile as covered."""
+        if self.poi_store is None:
+            return
+        
+        def write():
+            self.poi_store.upsert_places(places, keyword)
+            if page == 0:
+                self.poi_store.mark_covered(tile, keyword, radius)
+        
+        try:
+            # SQLite calls block, so they run off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, write)
+        except Exception as e:
+            print(f"Error writing to POI store: {e}")
     
     def _deduplicate_places(self, places: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Remove duplicate places based on place_id"""
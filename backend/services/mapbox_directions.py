@@ -1,22 +1,83 @@
+import asyncio
 import httpx
 import os
-from typing import List, Dict, Any, Optional
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
+from .single_flight import SingleFlight
+from .cache import TTLCache
+from .walking_estimator import WalkingEstimator
+from .geo import simplify_line, encode_polyline
+from .metrics import InstrumentedTransport
 
 class MapboxDirectionsService:
     """
     Service for getting walking directions between trail stops using Mapbox Directions API.
     """
     
-    def __init__(self):
+    def __init__(self, walking_estimator: Optional[WalkingEstimator] = None):
         load_dotenv('../.env.local')
         load_dotenv()  # Also load from current directory if exists
         
         self.api_key = os.getenv('NEXT_PUBLIC_MAPBOX_TOKEN')
         self.base_url = "https://api.mapbox.com/directions/v5/mapbox"
+        self.matrix_url = "https://api.mapbox.com/directions-matrix/v1/mapbox"
         
         if not self.api_key:
             print("Warning: NEXT_PUBLIC_MAPBOX_TOKEN not found in environment variables")
+        
+        # Shared HTTP/2 client, opened in the app lifespan
+        self.client: Optional[httpx.AsyncClient] = None
+        self.max_connections = int(os.getenv('MAPBOX_MAX_CONNECTIONS', '10'))
+        self.request_timeout = float(os.getenv('MAPBOX_TIMEOUT', '10'))
+        
+        # Routes are cached by their rounded coordinate sequence (5 decimals is ~1 m),
+        # and each leg is cached by its rounded (from, to) pair
+        self.coordinate_precision = 5
+        cache_ttl = float(os.getenv('MAPBOX_CACHE_TTL', '86400'))
+        cache_max_entries = int(os.getenv('MAPBOX_CACHE_MAX_ENTRIES', '2048'))
+        self.route_cache = TTLCache(max_entries=cache_max_entries, ttl=cache_ttl)
+        self.leg_cache = TTLCache(max_entries=cache_max_entries * 4, ttl=cache_ttl)
+        
+        # Walking matrix cells are cached by their rounded (from, to) pair. The Matrix
+        # API takes at most 25 coordinates, so larger matrices are requested as
+        # blocks of `matrix_block_size` sources by `matrix_block_size` destinations.
+        self.matrix_cache = TTLCache(max_entries=int(os.getenv('MAPBOX_MATRIX_CACHE_MAX_ENTRIES', '50000')), ttl=cache_ttl)
+        self.matrix_max_coordinates = 25
+        self.matrix_block_size = 12
+        
+        # Identical routes already in flight share one request
+        self.single_flight = SingleFlight()
+        
+        # Offline fallback when Mapbox is unavailable
+        self.walking_estimator = walking_estimator or WalkingEstimator()
+    
+    async def start(self):
+        """Create the shared, pooled HTTP client. Called from the app lifespan."""
+        if self.client is None:
+            try:
+                import h2  # noqa: F401
+                http2 = True
+            except ImportError:
+                print("Warning: h2 not installed, Mapbox client falls back to HTTP/1.1")
+                http2 = False
+            
+            self.client = httpx.AsyncClient(
+                timeout=self.request_timeout,
+                transport=InstrumentedTransport('mapbox', httpx.AsyncHTTPTransport(
+                    http2=http2,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections
+                    )
+                ))
+            )
+    
+    async def close(self):
+        """Close the shared HTTP client."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
     
     async def get_walking_directions(self, coordinates: List[Dict[str, float]]) -> Optional[Dict[str, Any]]:
         """
@@ -33,11 +94,63 @@ class MapboxDirectionsService:
             - steps: Detailed turn-by-turn directions
         """
         if not self.api_key:
-            return self._get_mock_directions(coordinates)
+            return await self._get_estimated_directions(coordinates)
         
         if len(coordinates) < 2:
             return None
+        
+        points = [self._round_point(coord) for coord in coordinates]
+        route_key = ";".join(f"{lng},{lat}" for lat, lng in points)
+        
+        cached = self.route_cache.get(route_key)
+        if cached is not None:
+            return cached
+        
+        # Only legs missing from the leg cache are fetched. Adjacent missing legs form one
+        # run that needs a single multi-waypoint request, so a cold route is still one call
+        # and swapping stop i refetches just the legs i-1 -> i -> i+1.
+        legs = [self.leg_cache.get(pair) for pair in zip(points, points[1:])]
+        runs = self._missing_leg_runs(legs)
+        
+        if runs:
+            fetched = await asyncio.gather(*[
+                self.single_flight.do(
+                    ";".join(f"{lng},{lat}" for lat, lng in points[start:end + 1]),
+                    lambda start=start, end=end: self._fetch_legs(coordinates[start:end + 1], points[start:end + 1])
+                )
+                for start, end in runs
+            ])
+            if any(run_legs is None for run_legs in fetched):
+                return await self._get_estimated_directions(coordinates)
             
+            for (start, end), run_legs in zip(runs, fetched):
+                legs[start:end] = run_legs
+        
+        route = self._assemble_route(legs)
+        self.route_cache.set(route_key, route)
+        return route
+    
+    def _round_point(self, coord: Dict[str, float]) -> Optional[Tuple[float, float]]:
+        if coord.get('lat') is None or coord.get('lng') is None:
+            return None
+        return (round(coord['lat'], self.coordinate_precision), round(coord['lng'], self.coordinate_precision))
+    
+    def _missing_leg_runs(self, legs: List[Optional[Dict[str, Any]]]) -> List[Tuple[int, int]]:
+        """(start, end) waypoint index ranges covering each run of consecutive uncached legs."""
+        runs = []
+        start = None
+        for i, leg in enumerate(legs):
+            if leg is None and start is None:
+                start = i
+            elif leg is not None and start is not None:
+                runs.append((start, i))
+                start = None
+        if start is not None:
+            runs.append((start, len(legs)))
+        return runs
+    
+    async def _fetch_legs(self, coordinates: List[Dict[str, float]], points: List[Tuple[float, float]]) -> Optional[List[Dict[str, Any]]]:
+        """Request a walking route from Mapbox and return (and cache) its formatted legs. Returns None on failure."""
         try:
             # Format coordinates for Mapbox API (longitude,latitude)
             coord_string = ";".join([f"{coord['lng']},{coord['lat']}" for coord in coordinates])
@@ -45,36 +158,75 @@ class MapboxDirectionsService:
             # Build request URL
             url = f"{self.base_url}/walking/{coord_string}"
             
+            # Route geometry is stitched from the step geometries of each leg
             params = {
                 "access_token": self.api_key,
                 "geometries": "geojson",
                 "steps": "true",
-                "overview": "full"
+                "overview": "false"
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
+            if self.client is None:
+                # Service used outside the app lifespan (e.g. scripts) - use a short-lived client
+                async with httpx.AsyncClient(timeout=self.request_timeout, transport=InstrumentedTransport('mapbox')) as client:
+                    response = await client.get(url, params=params)
+            else:
+                response = await self.client.get(url, params=params)
+            response.raise_for_status()
+            
+            data = response.json()
+            
+            if data.get("routes") and len(data["routes"]) > 0:
+                route_legs = data["routes"][0].get("legs", [])
+                if len(route_legs) != len(points) - 1:
+                    print("Unexpected number of legs in Mapbox response")
+                    return None
                 
-                data = response.json()
+                legs = [self._format_leg(leg) for leg in route_legs]
+                for pair, leg in zip(zip(points, points[1:]), legs):
+                    self.leg_cache.set(pair, leg)
+                return legs
+            else:
+                print("No routes found in Mapbox response")
+                return None
                 
-                if data.get("routes") and len(data["routes"]) > 0:
-                    route = data["routes"][0]
-                    
-                    return {
-                        "geometry": route["geometry"],
-                        "duration": route["duration"],  # seconds
-                        "distance": route["distance"],  # meters
-                        "steps": self._format_steps(route.get("legs", [])),
-                        "polyline": route["geometry"]["coordinates"]
-                    }
-                else:
-                    print("No routes found in Mapbox response")
-                    return self._get_mock_directions(coordinates)
-                    
         except Exception as e:
             print(f"Error fetching directions from Mapbox: {e}")
-            return self._get_mock_directions(coordinates)
+            return None
+    
+    def _format_leg(self, leg: Dict[str, Any]) -> Dict[str, Any]:
+        """Reduce a Mapbox leg to what is needed to rebuild a route: totals, steps and geometry."""
+        coordinates = []
+        for step in leg.get("steps", []):
+            for point in step.get("geometry", {}).get("coordinates", []):
+                if not coordinates or coordinates[-1] != point:
+                    coordinates.append(point)
+        
+        return {
+            "duration": leg.get("duration", 0),
+            "distance": leg.get("distance", 0),
+            "steps": self._format_steps([leg]),
+            "coordinates": coordinates
+        }
+    
+    def _assemble_route(self, legs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Stitch cached legs back into the route shape returned by get_walking_directions."""
+        coordinates = []
+        steps = []
+        for leg in legs:
+            for point in leg["coordinates"]:
+                if not coordinates or coordinates[-1] != point:
+                    coordinates.append(point)
+            steps.extend(leg["steps"])
+        
+        geometry = {"type": "LineString", "coordinates": coordinates}
+        return {
+            "geometry": geometry,
+            "duration": sum(leg["duration"] for leg in legs),
+            "distance": sum(leg["distance"] for leg in legs),
+            "steps": steps,
+            "polyline": coordinates
+        }
     
     def _format_steps(self, legs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Format the detailed turn-by-turn directions."""
@@ -92,45 +244,158 @@ class MapboxDirectionsService:
         
         return formatted_steps
     
-    def _get_mock_directions(self, coordinates: List[Dict[str, float]]) -> Dict[str, Any]:
-        """Return mock directions data for development/testing."""
-        total_distance = 0
-        total_duration = 0
-        
-        # Calculate approximate walking distance and time
-        for i in range(len(coordinates) - 1):
-            # Simple distance calculation (not accurate for real use)
-            lat_diff = abs(coordinates[i+1]["lat"] - coordinates[i]["lat"])
-            lng_diff = abs(coordinates[i+1]["lng"] - coordinates[i]["lng"])
-            segment_distance = ((lat_diff ** 2 + lng_diff ** 2) ** 0.5) * 111000  # rough meters
+    async def get_walking_matrix(self, points: List[Dict[str, float]]) -> Dict[str, List[List[float]]]:
+        """
+        Get pairwise walking distances and durations between points.
+        
+        Args:
+            points: List of {"lat": float, "lng": float} dictionaries
+            
+        Returns:
+            Dictionary with 'distances' (meters) and 'durations' (seconds) as
+            square matrices indexed [from][to]. Cells Mapbox cannot provide are
+            filled in by the offline walking estimator.
+        """
+        n = len(points)
+        lats = np.array([point.get('lat', np.nan) for point in points], dtype=float)
+        lngs = np.array([point.get('lng', np.nan) for point in points], dtype=float)
+        distances = np.full((n, n), np.nan)
+        durations = np.full((n, n), np.nan)
+        np.fill_diagonal(distances, 0.0)
+        np.fill_diagonal(durations, 0.0)
+        
+        if self.api_key and n > 1:
+            rounded = [self._round_point(point) for point in points]
+            for i in range(n):
+                for j in range(n):
+                    if i != j and rounded[i] is not None and rounded[j] is not None:
+                        cell = self.matrix_cache.get((rounded[i], rounded[j]))
+                        if cell is not None:
+                            distances[i, j], durations[i, j] = cell
             
-            total_distance += segment_distance
-            total_duration += segment_distance / 1.4  # ~1.4 m/s walking speed
+            # Only blocks with uncached cells are requested, all at once on the shared client
+            located = [i for i in range(n) if not np.isnan(lats[i]) and not np.isnan(lngs[i])]
+            if len(located) <= self.matrix_max_coordinates:
+                blocks = [located] if len(located) > 1 else []
+            else:
+                blocks = [located[start:start + self.matrix_block_size] for start in range(0, len(located), self.matrix_block_size)]
+            requests = [
+                (sources, destinations)
+                for sources in blocks for destinations in blocks
+                if np.isnan(distances[np.ix_(sources, destinations)]).any()
+            ]
+            results = await asyncio.gather(*[
+                self._fetch_matrix_block(points, rounded, sources, destinations)
+                for sources, destinations in requests
+            ])
+            
+            for (sources, destinations), result in zip(requests, results):
+                if result is None:
+                    continue
+                block_distances, block_durations = result
+                block = np.ix_(sources, destinations)
+                distances[block] = np.where(np.isnan(block_distances), distances[block], block_distances)
+                durations[block] = np.where(np.isnan(block_durations), durations[block], block_durations)
         
-        # Create mock polyline coordinates
-        polyline = []
-        for coord in coordinates:
-            polyline.append([coord["lng"], coord["lat"]])
+        missing = np.isnan(distances)
+        if missing.any():
+            if self.walking_estimator.has_graph:
+                # Graph routing is CPU-bound; keep it off the event loop
+                loop = asyncio.get_running_loop()
+                estimated = await loop.run_in_executor(None, self.walking_estimator.distance_matrix, lats, lngs)
+            else:
+                estimated = self.walking_estimator.distance_matrix(lats, lngs)
+            distances[missing] = estimated[missing]
+            durations[missing] = estimated[missing] / self.walking_estimator.walking_speed
         
         return {
-            "geometry": {
-                "type": "LineString",
-                "coordinates": polyline
-            },
-            "duration": int(round(total_duration)),
-            "distance": int(round(total_distance)),
-            "steps": [
-                {
-                    "instruction": f"Walk to {coordinates[i+1].get('name', f'Stop {i+2}')}",
-                    "distance": int(round(total_distance / (len(coordinates) - 1))),
-                    "duration": int(round(total_duration / (len(coordinates) - 1))),
-                    "type": "continue"
-                }
-                for i in range(len(coordinates) - 1)
-            ],
-            "polyline": polyline
+            'distances': distances.tolist(),
+            'durations': durations.tolist()
         }
     
+    async def _fetch_matrix_block(self, points: List[Dict[str, float]], rounded: List[Tuple[float, float]],
+                                  sources: List[int], destinations: List[int]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Request one sources x destinations block from the Matrix API and cache its cells. Returns None on failure."""
+        # A diagonal block is sent once as all-to-all; otherwise sources are followed by destinations
+        indices = sources if sources == destinations else sources + destinations
+        coord_string = ";".join(f"{points[i]['lng']},{points[i]['lat']}" for i in indices)
+        params = {
+            "access_token": self.api_key,
+            "annotations": "distance,duration"
+        }
+        if sources != destinations:
+            params["sources"] = ";".join(str(k) for k in range(len(sources)))
+            params["destinations"] = ";".join(str(len(sources) + k) for k in range(len(destinations)))
+        
+        async def fetch():
+            url = f"{self.matrix_url}/walking/{coord_string}"
+            if self.client is None:
+                async with httpx.AsyncClient(timeout=self.request_timeout, transport=InstrumentedTransport('mapbox')) as client:
+                    response = await client.get(url, params=params)
+            else:
+                response = await self.client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        
+        try:
+            data = await self.single_flight.do(("matrix", coord_string, params.get("sources")), fetch)
+            if data.get("code") != "Ok":
+                print(f"Mapbox Matrix API error: {data.get('code')}")
+                return None
+            
+            # Unroutable pairs come back as null
+            block_distances = np.array(data["distances"], dtype=float)
+            block_durations = np.array(data["durations"], dtype=float)
+            for a, i in enumerate(sources):
+                for b, j in enumerate(destinations):
+                    if i != j and not np.isnan(block_distances[a, b]) and not np.isnan(block_durations[a, b]):
+                        self.matrix_cache.set((rounded[i], rounded[j]), (float(block_distances[a, b]), float(block_durations[a, b])))
+            return block_distances, block_durations
+        
+        except Exception as e:
+            print(f"Error fetching walking matrix from Mapbox: {e}")
+            return None
+    
+    async def _get_estimated_directions(self, coordinates: List[Dict[str, float]]) -> Dict[str, Any]:
+        """Offline directions estimate, used without a Mapbox token or when Mapbox fails."""
+        if self.walking_estimator.has_graph:
+            # Graph routing is CPU-bound; keep it off the event loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.walking_estimator.estimate_route, coordinates)
+        return self.walking_estimator.estimate_route(coordinates)
+    
+    def compact_directions(self, directions: Dict[str, Any], geometry_format: str = "geojson",
+                           simplify_tolerance: Optional[float] = None, include_step_geometry: bool = True) -> Dict[str, Any]:
+        """
+        Return a copy of a directions result with a smaller geometry payload.
+        
+        Args:
+            directions: Result of get_walking_directions (left unmodified, it may be cached)
+            geometry_format: "geojson" for LineString dicts, "polyline6" for encoded polyline strings
+            simplify_tolerance: Douglas-Peucker tolerance in meters, applied before encoding
+            include_step_geometry: Whether each step keeps its own geometry
+        """
+        def shape(geometry: Dict[str, Any]):
+            coordinates = geometry.get("coordinates", [])
+            if simplify_tolerance:
+                coordinates = simplify_line(coordinates, simplify_tolerance)
+            if geometry_format == "polyline6":
+                return encode_polyline(coordinates, precision=6)
+            return {"type": geometry.get("type", "LineString"), "coordinates": coordinates}
+        
+        steps = []
+        for step in directions["steps"]:
+            compact_step = {key: value for key, value in step.items() if key != "geometry"}
+            if include_step_geometry and step.get("geometry"):
+                compact_step["geometry"] = shape(step["geometry"])
+            steps.append(compact_step)
+        
+        # `polyline` duplicates the route geometry and is not part of the response
+        compact = {key: value for key, value in directions.items() if key != "polyline"}
+        compact["geometry"] = shape(directions["geometry"])
+        compact["steps"] = steps
+        return compact
+    
     def format_duration(self, seconds: int) -> str:
         """Convert seconds to human-readable duration."""
         if seconds < 60:
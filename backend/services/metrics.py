@@ -0,0 +1,284 @@
+import bisect
+import contextvars
+import secrets
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+
+# Latency buckets in seconds, from cache hits to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Payload size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _ValueMetric(_Metric):
+    """
+    One value per label set. With a `callback`, values are also read at scrape
+    time from counters the services already keep; it returns {label values tuple: value}.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        values = dict(self._values)
+        if self.callback is not None:
+            try:
+                values.update(self.callback())
+            except Exception as e:
+                print(f"Warning: metrics callback for {self.name} failed: {e}")
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Counter(_ValueMetric):
+    """Monotonically increasing count per label set."""
+
+    kind = "counter"
+
+
+class Gauge(_ValueMetric):
+    """Current value per label set."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label set, with sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            samples.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), callback=None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "localvibe_http_request_duration_seconds", "API request latency.", ("method", "route", "status"))
+HTTP_RESPONSE_BYTES = REGISTRY.histogram(
+    "localvibe_http_response_size_bytes", "API response body size.", ("route",), SIZE_BUCKETS)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "localvibe_http_requests_in_flight", "API requests currently being handled.")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "localvibe_stage_duration_seconds", "Latency of trail pipeline stages.", ("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "localvibe_stage_errors_total", "Trail pipeline stages that raised.", ("stage",))
+
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "localvibe_upstream_request_duration_seconds", "Latency of calls to upstream APIs.", ("service", "status"))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "localvibe_upstream_errors_total", "Upstream calls that failed or returned an error status.", ("service", "error"))
+UPSTREAM_RESPONSE_BYTES = REGISTRY.histogram(
+    "localvibe_upstream_response_size_bytes", "Upstream response body size.", ("service",), SIZE_BUCKETS)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "localvibe_upstream_requests_in_flight", "Upstream calls currently in flight.", ("service",))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage and count it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+@contextmanager
+def upstream_call(service: str) -> Iterator[None]:
+    """Time an upstream call made without httpx (e.g. an SDK), counting exceptions as errors."""
+    UPSTREAM_IN_FLIGHT.inc(service=service)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = "error"
+        UPSTREAM_ERRORS.inc(service=service, error=type(e).__name__)
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.dec(service=service)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, service=service, status=status)
+
+
+# W3C trace context of the request being handled, propagated to upstream calls
+_trace_context: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar("trace_context", default=None)
+
+
+def start_trace(traceparent: Optional[str] = None) -> Tuple[contextvars.Token, str]:
+    """
+    Continue the trace from an incoming `traceparent` header, or start a new one.
+    Returns the context token (for `end_trace`) and this request's traceparent.
+    """
+    trace_id = None
+    if traceparent:
+        parts = traceparent.strip().split("-")
+        if len(parts) == 4 and len(parts[1]) == 32 and parts[1] != "0" * 32:
+            trace_id = parts[1].lower()
+    if trace_id is None:
+        trace_id = secrets.token_hex(16)
+
+    span_id = secrets.token_hex(8)
+    token = _trace_context.set((trace_id, span_id))
+    return token, f"00-{trace_id}-{span_id}-01"
+
+
+def end_trace(token: contextvars.Token):
+    _trace_context.reset(token)
+
+
+def current_traceparent() -> Optional[str]:
+    """A child traceparent for an outgoing call, or None outside a traced request."""
+    context = _trace_context.get()
+    if context is None:
+        return None
+    return f"00-{context[0]}-{secrets.token_hex(8)}-01"
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport wrapper that times upstream calls per service (up to the
+    response headers), counts errors, records response sizes and propagates the
+    current trace context.
+    """
+
+    def __init__(self, service: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.service = service
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        traceparent = current_traceparent()
+        if traceparent and "traceparent" not in request.headers:
+            request.headers["traceparent"] = traceparent
+
+        UPSTREAM_IN_FLIGHT.inc(service=self.service)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            if response.status_code >= 400:
+                UPSTREAM_ERRORS.inc(service=self.service, error=f"http_{response.status_code}")
+            content_length = response.headers.get("content-length")
+            if content_length and content_length.isdigit():
+                UPSTREAM_RESPONSE_BYTES.observe(int(content_length), service=self.service)
+            return response
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(service=self.service, error=type(e).__name__)
+            raise
+        finally:
+            UPSTREAM_IN_FLIGHT.dec(service=self.service)
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, service=self.service, status=status)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
@@ -0,0 +1,168 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional
+from .geo import haversine_distances
+
+# Degrees of latitude per meter; longitude degrees are scaled by cos(latitude)
+_DEGREES_PER_METER = 1 / 111320.0
+
+
+class PoiStore:
+    """
+    Local spatial store of every place Google Places has returned.
+
+    Places live in SQLite with an R-tree over their coordinates, a normalized
+    type table (the sparse type vector of each place) and a precomputed quality
+    score. Coverage is tracked per (geohash tile, keyword, radius) so searches
+    in a recently harvested tile can be answered locally, and live calls only
+    top the store up once coverage goes stale.
+
+    Methods are blocking and thread-safe (one lock around the connection), so
+    async callers can run them in an executor.
+    """
+
+    def __init__(self, path: str, coverage_ttl: float = 7 * 86400):
+        self.path = path
+        self.coverage_ttl = coverage_ttl
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS pois (
+                    id INTEGER PRIMARY KEY,
+                    place_id TEXT UNIQUE NOT NULL,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    quality_score REAL NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS pois_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng);
+                CREATE TABLE IF NOT EXISTS poi_types (
+                    type TEXT NOT NULL,
+                    poi_id INTEGER NOT NULL,
+                    PRIMARY KEY (type, poi_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS poi_keywords (
+                    keyword TEXT NOT NULL,
+                    poi_id INTEGER NOT NULL,
+                    PRIMARY KEY (keyword, poi_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS tile_coverage (
+                    tile TEXT NOT NULL,
+                    keyword TEXT NOT NULL,
+                    radius INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (tile, keyword, radius)
+                ) WITHOUT ROWID;
+            """)
+
+    def upsert_places(self, places: List[Dict[str, Any]], keyword: Optional[str] = None):
+        """Insert or refresh places, tagging them with the keyword they were found by."""
+        now = time.time()
+        with self._lock, self.conn:
+            for place in places:
+                place_id = place.get('place_id')
+                location = place.get('geometry', {}).get('location', {})
+                if not place_id or 'lat' not in location or 'lng' not in location:
+                    continue
+
+                lat, lng = float(location['lat']), float(location['lng'])
+                self.conn.execute(
+                    """
+                    INSERT INTO pois (place_id, lat, lng, quality_score, data, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(place_id) DO UPDATE SET
+                        lat = excluded.lat, lng = excluded.lng, quality_score = excluded.quality_score,
+                        data = excluded.data, updated_at = excluded.updated_at
+                    """,
+                    (place_id, lat, lng, self._quality_score(place), json.dumps(place), now)
+                )
+                poi_id = self.conn.execute("SELECT id FROM pois WHERE place_id = ?", (place_id,)).fetchone()[0]
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO pois_rtree (id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)",
+                    (poi_id, lat, lat, lng, lng)
+                )
+                self.conn.execute("DELETE FROM poi_types WHERE poi_id = ?", (poi_id,))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO poi_types (type, poi_id) VALUES (?, ?)",
+                    [(place_type, poi_id) for place_type in place.get('types', [])]
+                )
+                if keyword:
+                    self.conn.execute("INSERT OR IGNORE INTO poi_keywords (keyword, poi_id) VALUES (?, ?)", (keyword, poi_id))
+
+    def mark_covered(self, tile: str, keyword: str, radius: int):
+        """Record that a tile was just harvested live for a keyword and radius."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tile_coverage (tile, keyword, radius, fetched_at) VALUES (?, ?, ?, ?)",
+                (tile, keyword, radius, time.time())
+            )
+
+    def is_covered(self, tile: str, keyword: str, radius: int) -> bool:
+        """True if the tile was harvested for this keyword and radius within the coverage TTL."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT fetched_at FROM tile_coverage WHERE tile = ? AND keyword = ? AND radius = ?",
+                (tile, keyword, radius)
+            ).fetchone()
+        return row is not None and row[0] > time.time() - self.coverage_ttl
+
+    def query(self, lat: float, lng: float, radius: float, types: Optional[List[str]] = None,
+              keyword: Optional[str] = None, limit: int = 60) -> List[Dict[str, Any]]:
+        """
+        Places within `radius` meters, optionally having one of `types` or found by `keyword`,
+        best quality first.
+        """
+        lat_delta = radius * _DEGREES_PER_METER
+        lng_delta = lat_delta / max(math.cos(math.radians(lat)), 1e-6)
+
+        sql = """
+            SELECT p.id, p.lat, p.lng FROM pois_rtree r
+            JOIN pois p ON p.id = r.id
+            WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lng >= ? AND r.max_lng <= ?
+        """
+        params: List[Any] = [lat - lat_delta, lat + lat_delta, lng - lng_delta, lng + lng_delta]
+
+        if types:
+            sql += f" AND p.id IN (SELECT poi_id FROM poi_types WHERE type IN ({','.join('?' * len(types))}))"
+            params.extend(types)
+        if keyword:
+            sql += " AND p.id IN (SELECT poi_id FROM poi_keywords WHERE keyword = ?)"
+            params.append(keyword)
+
+        sql += " ORDER BY p.quality_score DESC"
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            if not rows:
+                return []
+
+            # The R-tree returns a bounding box; trim it to the actual circle, then
+            # load and decode the place data of the survivors only
+            distances = haversine_distances(lat, lng, [row[1] for row in rows], [row[2] for row in rows])
+            ids = [row[0] for row, distance in zip(rows, distances) if distance <= radius][:limit]
+            if not ids:
+                return []
+            data = dict(self.conn.execute(
+                f"SELECT id, data FROM pois WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall())
+        return [json.loads(data[poi_id]) for poi_id in ids]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _quality_score(self, place: Dict[str, Any]) -> float:
+        """Same rating/review-count blend as TrailModel's quality score."""
+        rating = float(place.get('rating', 0) or 0)
+        review_count = float(place.get('user_ratings_total', 0) or 0)
+        return rating / 5.0 * 0.7 + min(1.0, math.log(max(review_count, 1)) / math.log(1000)) * 0.3
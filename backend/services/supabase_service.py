@@ -1,12 +1,29 @@
+import asyncio
+import base64
+import json
 import os
-from supabase import create_client, Client
-from typing import Dict, Any, Optional
+import re
+import uuid
+from datetime import datetime, timezone
+from supabase import acreate_client, AsyncClient
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from typing import List, Dict, Any, Optional, Tuple
+from .metrics import upstream_call
 
 class SupabaseService:
     """
     Service for interacting with Supabase for authentication and data storage.
+    
+    Uses the async Supabase client, whose PostgREST session keeps its connections
+    alive between calls. Saved trails are written behind: `save_trail` assigns the
+    trail id client-side and returns at once, and queued rows are sent as one bulk
+    insert when the batch fills up or the flush interval passes.
     """
     
+    # Listing projection: generated summary columns only, never the trail_data blob
+    TRAIL_SUMMARY_COLUMNS = 'id, title, vibes, stop_count, first_stop_lat, first_stop_lng, created_at'
+    
     def __init__(self):
         from dotenv import load_dotenv
         # Load environment variables from project root
@@ -16,10 +33,28 @@ class SupabaseService:
         self.supabase_url = os.getenv('SUPABASE_URL')
         self.supabase_key = os.getenv('SUPABASE_ANON_KEY')
         
-        if self.supabase_url and self.supabase_key:
+        # Created in start(), since the async client is built in the event loop
+        self.client: Optional[AsyncClient] = None
+        
+        if not (self.supabase_url and self.supabase_key):
+            print("Warning: Supabase credentials not found in environment variables")
+        
+        # Write-behind queue for saved trails
+        self.write_batch_size = int(os.getenv('SUPABASE_WRITE_BATCH_SIZE', '50'))
+        self.write_flush_interval = float(os.getenv('SUPABASE_WRITE_FLUSH_MS', '500')) / 1000
+        self.write_max_attempts = 3
+        self._pending_trails: List[Dict[str, Any]] = []
+        self._inflight_trails: List[Dict[str, Any]] = []  # batch currently being inserted
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    async def start(self):
+        """Create the async client and start the trail writer. Called from the app lifespan."""
+        if self.client is None and self.supabase_url and self.supabase_key:
             try:
-                # Initialize Supabase client with minimal options to avoid compatibility issues
-                self.client: Client = create_client(
+                self.client = await acreate_client(
                     supabase_url=self.supabase_url,
                     supabase_key=self.supabase_key
                 )
@@ -29,8 +64,23 @@ class SupabaseService:
                 print(f"Error details: {type(e).__name__}: {str(e)}")
                 # For now, continue without Supabase for development
                 self.client = None
-        else:
-            print("Warning: Supabase credentials not found in environment variables")
+        
+        if self.client is not None and self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._write_behind_loop())
+    
+    async def close(self):
+        """Flush queued trails, stop the writer and close the client."""
+        if self._writer_task is not None:
+            # Let the writer finish the batch it is inserting rather than cancelling it mid-write
+            self._stopping = True
+            self._flush_requested.set()
+            await self._writer_task
+            self._writer_task = None
+        
+        await self.flush_trails()
+        
+        if self.client is not None:
+            await self.client.postgrest.aclose()
             self.client = None
     
     async def create_user(self, email: str, password: str) -> Optional[Dict[str, Any]]:
@@ -39,7 +89,7 @@ class SupabaseService:
             return None
         
         try:
-            response = self.client.auth.sign_up({
+            response = await self.client.auth.sign_up({
                 "email": email,
                 "password": password
             })
@@ -63,7 +113,7 @@ class SupabaseService:
             return None
         
         try:
-            response = self.client.auth.sign_in_with_password({
+            response = await self.client.auth.sign_in_with_password({
                 "email": email,
                 "password": password
             })
@@ -82,26 +132,101 @@ class SupabaseService:
             return None
     
     async def save_trail(self, user_id: str, trail_data: Dict[str, Any], vibes: list[str]) -> Optional[str]:
-        """Save a generated trail to the user's profile."""
+        """Queue a generated trail for saving to the user's profile and return its id."""
         if not self.client:
             return None
         
-        try:
-            # Insert trail data into saved_trails table
-            response = self.client.table('saved_trails').insert({
+        trail_id = str(uuid.uuid4())
+        self._pending_trails.append({
+            'row': {
+                'id': trail_id,
                 'user_id': user_id,
                 'trail_data': trail_data,
-                'vibes': vibes
-            }).execute()
-            
-            if response.data:
-                return response.data[0]['id']
-            
-            return None
-            
+                'vibes': vibes,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            },
+            'attempts': 0
+        })
+        
+        if len(self._pending_trails) >= self.write_batch_size:
+            self._flush_requested.set()
+        
+        return trail_id
+    
+    async def flush_trails(self):
+        """
+        Insert all queued trails in bulk. Rows that fail are re-queued up to
+        `write_max_attempts` times, then dropped with their ids logged.
+        """
+        async with self._flush_lock:
+            while self._pending_trails and self.client:
+                batch = self._pending_trails[:self.write_batch_size]
+                del self._pending_trails[:len(batch)]
+                self._inflight_trails = list(batch)
+                
+                try:
+                    failed = await self._insert_trails(batch)
+                except asyncio.CancelledError:
+                    # The caller was cancelled mid-insert; keep the unwritten rows for the next flush
+                    self._pending_trails[:0] = self._inflight_trails
+                    raise
+                finally:
+                    self._inflight_trails = []
+                
+                if failed:
+                    retry = [entry for entry in failed if entry['attempts'] + 1 < self.write_max_attempts]
+                    for entry in retry:
+                        entry['attempts'] += 1
+                    dropped = [entry['row']['id'] for entry in failed if entry not in retry]
+                    if dropped:
+                        print(f"Dropping {len(dropped)} trails after {self.write_max_attempts} failed attempts: {', '.join(dropped)}")
+                    self._pending_trails[:0] = retry
+                    break
+    
+    async def _insert_trails(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Bulk insert queued trails and return the entries that failed. A batch
+        rejected by the database (e.g. one row violating a constraint or policy)
+        is split in half and retried, so only the bad rows fail.
+        """
+        try:
+            with upstream_call('supabase'):
+                await self.client.table('saved_trails')\
+                    .insert([entry['row'] for entry in batch], returning=ReturnMethod.minimal)\
+                    .execute()
+        except APIError as e:
+            if len(batch) == 1:
+                print(f"Error saving trail {batch[0]['row']['id']}: {e}")
+                return batch
+            middle = len(batch) // 2
+            return await self._insert_trails(batch[:middle]) + await self._insert_trails(batch[middle:])
         except Exception as e:
-            print(f"Error saving trail: {e}")
-            return None
+            # Connection-level failure: the whole batch is retried later as it is
+            print(f"Error saving {len(batch)} trails: {e}")
+            return batch
+        
+        written = {id(entry) for entry in batch}
+        self._inflight_trails = [entry for entry in self._inflight_trails if id(entry) not in written]
+        return []
+    
+    async def _write_behind_loop(self):
+        """Flush queued trails whenever a batch fills up or the flush interval passes, until close()."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.write_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            
+            if self._pending_trails:
+                await self.flush_trails()
+    
+    def _queued_trails(self) -> List[Dict[str, Any]]:
+        """Trails not yet confirmed written: queued, or in the batch being inserted."""
+        return self._inflight_trails + self._pending_trails
+    
+    def _has_pending_trails(self, user_id: str) -> bool:
+        return any(entry['row']['user_id'] == user_id for entry in self._queued_trails())
     
     async def get_user_trails(self, user_id: str) -> list[Dict[str, Any]]:
         """Get all saved trails for a user."""
@@ -109,7 +234,11 @@ class SupabaseService:
             return []
         
         try:
-            response = self.client.table('saved_trails')\
+            # Queued trails must be visible to their owner
+            if self._has_pending_trails(user_id):
+                await self.flush_trails()
+            
+            response = await self.client.table('saved_trails')\
                 .select('*')\
                 .eq('user_id', user_id)\
                 .order('created_at', desc=True)\
@@ -121,13 +250,130 @@ class SupabaseService:
             print(f"Error fetching user trails: {e}")
             return []
     
+    async def list_user_trails(self, user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get one page of trail summaries for a user, newest first.
+        
+        Pages are keyset-paginated on (created_at, id), so every page costs the
+        same however deep it is, and only summary columns are read. Pass the
+        returned `next_cursor` to get the following page; it is None on the last one.
+        """
+        if not self.client:
+            return {'trails': [], 'next_cursor': None}
+        
+        try:
+            # Queued trails must be visible to their owner
+            if self._has_pending_trails(user_id):
+                await self.flush_trails()
+            
+            query = self.client.table('saved_trails')\
+                .select(self.TRAIL_SUMMARY_COLUMNS)\
+                .eq('user_id', user_id)
+            
+            if cursor:
+                created_at, trail_id = self._decode_cursor(cursor)
+                query = query.or_(
+                    f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{trail_id})'
+                )
+            
+            # One extra row tells whether another page exists
+            with upstream_call('supabase'):
+                response = await query\
+                    .order('created_at', desc=True)\
+                    .order('id', desc=True)\
+                    .limit(limit + 1)\
+                    .execute()
+            
+            rows = response.data if response.data else []
+            trails = rows[:limit]
+            next_cursor = self._encode_cursor(trails[-1]) if len(rows) > limit else None
+            
+            return {'trails': trails, 'next_cursor': next_cursor}
+            
+        except Exception as e:
+            print(f"Error listing user trails: {e}")
+            return {'trails': [], 'next_cursor': None}
+    
+    async def get_trail(self, trail_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get one saved trail with its full trail data."""
+        if not self.client:
+            return None
+        
+        for entry in self._queued_trails():
+            if entry['row']['id'] == trail_id and entry['row']['user_id'] == user_id:
+                return dict(entry['row'])
+        
+        try:
+            with upstream_call('supabase'):
+                response = await self.client.table('saved_trails')\
+                    .select('*')\
+                    .eq('id', trail_id)\
+                    .eq('user_id', user_id)\
+                    .limit(1)\
+                    .execute()
+            
+            return response.data[0] if response.data else None
+            
+        except Exception as e:
+            print(f"Error fetching trail: {e}")
+            return None
+    
+    def _encode_cursor(self, row: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps([row['created_at'], row['id']]).encode()).decode()
+    
+    def _decode_cursor(self, cursor: str) -> Tuple[str, str]:
+        created_at, trail_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Guard the values interpolated into the PostgREST filter
+        if not re.fullmatch(r'[0-9T:.+\- ]+', created_at):
+            raise ValueError("invalid cursor")
+        return created_at, str(uuid.UUID(trail_id))
+    
+    async def search_trails(self, vibes: List[str], lat: float, lng: float, radius_m: float = 1500,
+                            limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Find saved trails starting within `radius_m` meters of a point that share a vibe.
+        
+        Public trails (and the caller's own) come back best vibe match, most liked
+        and nearest first, via the `search_trails` RPC and its spatial index.
+        """
+        if not self.client:
+            return []
+        
+        try:
+            with upstream_call('supabase'):
+                response = await self.client.rpc('search_trails', {
+                    'p_vibes': vibes,
+                    'p_lat': lat,
+                    'p_lng': lng,
+                    'p_radius_m': radius_m,
+                    'p_limit': limit
+                }).execute()
+            
+            return response.data if response.data else []
+            
+        except Exception as e:
+            print(f"Error searching trails: {e}")
+            return []
+    
     async def delete_trail(self, trail_id: str, user_id: str) -> bool:
         """Delete a saved trail."""
         if not self.client:
             return False
         
+        # A trail being inserted right now is deleted once its batch settles,
+        # so the insert cannot bring it back afterwards
+        if any(entry['row']['id'] == trail_id for entry in self._inflight_trails):
+            async with self._flush_lock:
+                pass
+        
+        # A trail still waiting in the write-behind queue is simply dropped from it
+        for entry in self._pending_trails:
+            if entry['row']['id'] == trail_id and entry['row']['user_id'] == user_id:
+                self._pending_trails.remove(entry)
+                return True
+        
         try:
-            response = self.client.table('saved_trails')\
+            response = await self.client.table('saved_trails')\
                 .delete()\
                 .eq('id', trail_id)\
                 .eq('user_id', user_id)\
@@ -145,7 +391,7 @@ class SupabaseService:
             return None
         
         try:
-            response = self.client.table('profiles')\
+            response = await self.client.table('profiles')\
                 .select('*')\
                 .eq('id', user_id)\
                 .single()\
@@ -163,7 +409,7 @@ class SupabaseService:
             return False
         
         try:
-            response = self.client.table('profiles')\
+            response = await self.client.table('profiles')\
                 .update(profile_data)\
                 .eq('id', user_id)\
                 .execute()
@@ -188,7 +434,7 @@ class SupabaseService:
         
         try:
             # Try a simple query to test connection
-            response = self.client.table('saved_trails').select('count', count='exact').limit(1).execute()
+            response = await self.client.table('saved_trails').select('count', count='exact').limit(1).execute()
             
             return {
                 "status": "healthy",
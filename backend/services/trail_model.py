@@ -1,8 +1,16 @@
 import math
-from typing import List, Dict, Any
+import os
+import time
+import itertools
+import re
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
+import numpy as np
+from .geo import haversine_distances, haversine_matrix
+from .cache import TTLCache
+from .walking_estimator import WalkingEstimator
 
-@dataclass
+@dataclass(slots=True)
 class ScoredPlace:
     place: Dict[str, Any]
     score: float
@@ -17,7 +25,7 @@ class TrailModel:
     This is our core IP - the algorithm that makes LocalVibe unique.
     """
     
-    def __init__(self):
+    def __init__(self, walking_estimator: Optional[WalkingEstimator] = None):
         # Vibe-specific type mappings for relevance scoring
         self.vibe_type_mappings = {
             'cozy': ['cafe', 'book_store', 'library', 'tea_house', 'quiet_restaurant', 'park'],
@@ -65,37 +73,125 @@ class TrailModel:
                 'local_secret': 0.9, 'neighborhood_spot': 0.8, 'cafe': 0.6, 'restaurant': 0.6
             }
         }
+        
+        # Name keywords that signal a vibe
+        self.vibe_keywords = {
+            'cozy': ['cozy', 'quiet', 'peaceful', 'comfortable', 'warm'],
+            'artsy': ['art', 'creative', 'artistic', 'design', 'craft'],
+            'historic': ['historic', 'old', 'classic', 'traditional', 'heritage'],
+            'trendy': ['trendy', 'modern', 'hip', 'contemporary', 'stylish'],
+            'nature': ['nature', 'outdoor', 'green', 'natural', 'park'],
+            'foodie': ['food', 'culinary', 'gourmet', 'restaurant', 'dining'],
+            'nightlife': ['night', 'evening', 'vibrant', 'energetic', 'lively'],
+            'hidden': ['hidden', 'secret', 'local', 'neighborhood', 'gem']
+        }
+        self._compile_keyword_matcher()
+        
+        # Proximity scoring: distance decay (meters) towards the user and towards
+        # other strong candidates, blended with equal weight
+        self.user_distance_scale = 1500.0
+        self.neighbor_distance_scale = 400.0
+        
+        # Compile the relevance tables into a dense (vibes x known types) matrix once;
+        # the extra last column is an all-zero "no known type" slot
+        self._vibe_index = {vibe: i for i, vibe in enumerate(self.type_relevance_scores)}
+        known_types = sorted({place_type for scores in self.type_relevance_scores.values() for place_type in scores})
+        self._type_index = {place_type: j for j, place_type in enumerate(known_types)}
+        self._relevance_matrix = np.zeros((len(self._vibe_index), len(known_types) + 1))
+        for vibe, scores in self.type_relevance_scores.items():
+            for place_type, relevance in scores.items():
+                self._relevance_matrix[self._vibe_index[vibe], self._type_index[place_type]] = relevance
+        
+        # Route optimization: pick up to `trail_size` stops from the top of the
+        # ranking that maximize total score within a walking-distance budget
+        self.trail_size = 4
+        self.min_trail_size = 3
+        self.optimizer_pool_size = 20
+        self.exact_search_limit = 12  # pools this small are searched exhaustively
+        self.max_walk_distance = float(os.getenv('TRAIL_MAX_WALK_METERS', '3000'))
+        self.optimizer_time_budget = float(os.getenv('TRAIL_OPTIMIZER_BUDGET_MS', '50')) / 1000
+        
+        # Distance oracle for route planning: estimated walking meters, not straight lines
+        self.walking_estimator = walking_estimator or WalkingEstimator()
     
-    def score_and_select_pois(self, places: List[Dict[str, Any]], vibes: List[str]) -> List[Dict[str, Any]]:
+    def score_and_select_pois(self, places: List[Dict[str, Any]], vibes: List[str], origin: Optional[Tuple[float, float]] = None) -> List[Dict[str, Any]]:
         """
         Score and select the best POIs to create a cohesive trail.
         
         Args:
             places: List of candidate places from Google Places API
             vibes: List of selected vibe tags
+            origin: Optional (lat, lng) of the user, used for proximity scoring
             
         Returns:
             List of 3-4 selected places forming the trail
         """
+        return self.plan_trail(places, vibes, origin)['stops']
+    
+    def plan_trail(self, places: List[Dict[str, Any]], vibes: List[str], origin: Optional[Tuple[float, float]] = None,
+                   distance_matrix: Optional[List[List[float]]] = None) -> Dict[str, Any]:
+        """
+        Score candidates and plan a walkable trail.
+        
+        Args:
+            places: List of candidate places from Google Places API
+            vibes: List of selected vibe tags
+            origin: Optional (lat, lng) of the user
+            distance_matrix: Optional walking distances in meters between the places
+                returned by `candidate_pool` for the same arguments, in that order.
+                Defaults to the offline walking estimate.
+            
+        Returns:
+            Dictionary with 'stops' in visiting order and a 'route' summary
+            (place_id order, per-leg and total estimated walking distance in meters)
+        """
         if not places:
-            return []
+            return {'stops': [], 'route': None}
         
-        # Score each place
-        scored_places = []
-        for place in places:
-            score = self._calculate_place_score(place, vibes)
-            scored_places.append(score)
+        # Score each place, keeping only the top of the ranking (highest first)
+        scored_places = self._score_places(places, vibes, origin, top_k=self.optimizer_pool_size)
         
-        # Sort by score (highest first)
-        scored_places.sort(key=lambda x: x.score, reverse=True)
+        matrix = None
+        if distance_matrix is not None:
+            matrix = np.asarray(distance_matrix, dtype=float)
+            if matrix.shape != (len(scored_places), len(scored_places)):
+                print("Ignoring distance matrix that does not match the candidate pool")
+                matrix = None
+            else:
+                matrix = self._fill_missing_distances(matrix)
         
-        # Select top places and optimize for walkability
-        selected_places = self._optimize_trail_walkability(scored_places)
+        # Select the best stops that fit the walking budget, in walking order
+        selected_places, leg_distances = self._optimize_trail_walkability(scored_places, origin, matrix)
         
         # Format places for response
-        return self._format_places_for_response(selected_places)
+        stops = self._format_places_for_response(selected_places)
+        
+        return {
+            'stops': stops,
+            'route': {
+                'order': [stop['place_id'] for stop in stops],
+                'leg_distances': [int(round(distance)) for distance in leg_distances],
+                'total_distance': int(round(sum(leg_distances)))
+            }
+        }
+    
+    def route_summary(self, stops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """The 'route' summary `plan_trail` returns, recomputed for stops in their given order."""
+        leg_distances = []
+        if len(stops) > 1:
+            matrix = self._distance_matrix(stops)
+            leg_distances = [float(matrix[i, i + 1]) for i in range(len(stops) - 1)]
+        return {
+            'order': [stop.get('place_id') for stop in stops],
+            'leg_distances': [int(round(distance)) for distance in leg_distances],
+            'total_distance': int(round(sum(leg_distances)))
+        }
     
-    def get_alternative_stops(self, places: List[Dict[str, Any]], vibes: List[str], current_trail: Dict[str, Any], stop_index: int) -> List[Dict[str, Any]]:
+    def candidate_pool(self, places: List[Dict[str, Any]], vibes: List[str], origin: Optional[Tuple[float, float]] = None) -> List[Dict[str, Any]]:
+        """The places `plan_trail` routes between, in the order its `distance_matrix` is indexed."""
+        return [scored_place.place for scored_place in self._score_places(places, vibes, origin, top_k=self.optimizer_pool_size)]
+    
+    def get_alternative_stops(self, places: List[Dict[str, Any]], vibes: List[str], current_trail: Dict[str, Any], stop_index: int, origin: Optional[Tuple[float, float]] = None) -> List[Dict[str, Any]]:
         """
         Get alternative stops for a specific position in the trail.
         
@@ -104,6 +200,7 @@ class TrailModel:
             vibes: List of selected vibes
             current_trail: Current trail data
             stop_index: Index of the stop to replace
+            origin: Optional (lat, lng) of the user, used for proximity scoring
             
         Returns:
             List of alternative stops sorted by score
@@ -134,148 +231,386 @@ class TrailModel:
         if not filtered_places:
             return []
         
-        # Score the filtered places
-        scored_places = []
-        for place in filtered_places:
-            score = self._calculate_place_score(place, vibes)
-            scored_places.append(score)
-        
-        # Sort by score and return top alternatives
-        scored_places.sort(key=lambda x: x.score, reverse=True)
+        # Score the filtered places and keep the top 3 alternatives
+        scored_places = self._score_places(filtered_places, vibes, origin, top_k=3)
         
-        # Return top 3 alternatives
-        return self._format_places_for_response(scored_places[:3])
+        return self._format_places_for_response(scored_places)
     
-    def _calculate_place_score(self, place: Dict[str, Any], vibes: List[str]) -> ScoredPlace:
-        """Calculate a comprehensive score for a place based on multiple factors."""
+    def _score_places(self, places: List[Dict[str, Any]], vibes: List[str], origin: Optional[Tuple[float, float]] = None,
+                      top_k: Optional[int] = None) -> List[ScoredPlace]:
+        """
+        Score a whole candidate set at once, computing every sub-score with array operations.
+        
+        Returns ScoredPlace objects sorted by score (highest first), only for the
+        `top_k` best places when given, so large pools never allocate per-place results.
+        """
+        if not places:
+            return []
+        
+        ratings = np.array([float(place.get('rating', 0) or 0) for place in places])
+        review_counts = np.array([float(place.get('user_ratings_total', 0) or 0) for place in places])
         
         # 1. Vibe Match Score (how well the place matches selected vibes)
-        vibe_match_score = self._calculate_vibe_match_score(place, vibes)
+        vibe_match_scores = self._calculate_vibe_match_scores(places, vibes)
         
         # 2. Quality Score (based on ratings and review count)
-        quality_score = self._calculate_quality_score(place)
+        quality_scores = self._calculate_quality_scores(ratings, review_counts)
         
-        # 3. Proximity Score (how close to other potential stops)
-        proximity_score = self._calculate_proximity_score(place, vibes)
+        # 3. Hidden Gem Score (boost for highly-rated but less-reviewed places)
+        hidden_gem_scores = self._calculate_hidden_gem_scores(ratings, review_counts)
         
-        # 4. Hidden Gem Score (boost for highly-rated but less-reviewed places)
-        hidden_gem_score = self._calculate_hidden_gem_score(place)
+        # 4. Proximity Score (how close to the user and to other strong stops)
+        neighbor_quality = (vibe_match_scores * 0.4 + quality_scores * 0.3 + hidden_gem_scores * 0.1) / 0.8
+        proximity_scores = self._calculate_proximity_scores(places, neighbor_quality, origin)
         
         # 5. Calculate weighted final score
-        final_score = (
-            vibe_match_score * 0.4 +      # 40% weight for vibe matching
-            quality_score * 0.3 +         # 30% weight for quality
-            proximity_score * 0.2 +       # 20% weight for proximity
-            hidden_gem_score * 0.1        # 10% weight for hidden gem factor
+        final_scores = (
+            vibe_match_scores * 0.4 +      # 40% weight for vibe matching
+            quality_scores * 0.3 +         # 30% weight for quality
+            proximity_scores * 0.2 +       # 20% weight for proximity
+            hidden_gem_scores * 0.1        # 10% weight for hidden gem factor
         )
         
-        return ScoredPlace(
-            place=place,
-            score=final_score,
-            vibe_match_score=vibe_match_score,
-            quality_score=quality_score,
-            proximity_score=proximity_score,
-            hidden_gem_score=hidden_gem_score
-        )
+        return [
+            ScoredPlace(
+                place=places[i],
+                score=float(final_scores[i]),
+                vibe_match_score=float(vibe_match_scores[i]),
+                quality_score=float(quality_scores[i]),
+                proximity_score=float(proximity_scores[i]),
+                hidden_gem_score=float(hidden_gem_scores[i])
+            )
+            for i in self._top_k_indices(final_scores, len(places) if top_k is None else top_k).tolist()
+        ]
     
-    def _calculate_vibe_match_score(self, place: Dict[str, Any], vibes: List[str]) -> float:
-        """Calculate how well a place matches the selected vibes."""
-        if not place.get('types'):
-            return 0.0
-        
-        place_types = place['types']
-        total_score = 0.0
-        
-        for vibe in vibes:
-            vibe_score = 0.0
-            if vibe in self.type_relevance_scores:
-                for place_type in place_types:
-                    if place_type in self.type_relevance_scores[vibe]:
-                        vibe_score = max(vibe_score, self.type_relevance_scores[vibe][place_type])
-            
-            # Also check if place name/description contains vibe-related keywords
-            place_name = place.get('name', '').lower()
-            if any(keyword in place_name for keyword in self._get_vibe_keywords(vibe)):
-                vibe_score = max(vibe_score, 0.7)
-            
-            total_score += vibe_score
+    def _top_k_indices(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """
+        Indices of the k highest scores, highest first, in O(n) via argpartition.
         
-        return total_score / len(vibes)  # Average score across all vibes
+        Ties are broken by candidate order, matching a stable full sort.
+        """
+        if k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+        if k <= 0:
+            return np.array([], dtype=int)
+        
+        threshold = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        selected = np.sort(np.concatenate([above, ties]))
+        return selected[np.argsort(-scores[selected], kind='stable')]
     
-    def _calculate_quality_score(self, place: Dict[str, Any]) -> float:
-        """Calculate quality score based on ratings and review count."""
-        rating = place.get('rating', 0)
-        review_count = place.get('user_ratings_total', 0)
+    def _calculate_vibe_match_scores(self, places: List[Dict[str, Any]], vibes: List[str]) -> np.ndarray:
+        """Calculate how well each place matches the selected vibes, averaged across vibes."""
+        if not vibes:
+            return np.zeros(len(places))
+        
+        # Sparse type-indicator encoding: the known type columns of every place,
+        # concatenated, with segment offsets; places with no known type point at
+        # the all-zero column so every segment is non-empty
+        no_type_column = len(self._type_index)
+        type_columns = []
+        offsets = []
+        for place in places:
+            offsets.append(len(type_columns))
+            columns = [self._type_index[place_type] for place_type in place.get('types') or [] if place_type in self._type_index]
+            type_columns.extend(columns or [no_type_column])
+        
+        # Rows for the selected vibes; unknown vibes only score through keywords
+        rows = np.zeros((len(vibes), self._relevance_matrix.shape[1]))
+        for i, vibe in enumerate(vibes):
+            if vibe in self._vibe_index:
+                rows[i] = self._relevance_matrix[self._vibe_index[vibe]]
         
+        # Best type relevance per (vibe, place)
+        vibe_scores = np.maximum.reduceat(rows[:, type_columns], offsets, axis=1)
+        
+        # Also check if place name contains vibe-related keywords
+        matched_vibes = [self._match_vibe_keywords(place) for place in places]
+        keyword_matches = np.array([[vibe in matched for matched in matched_vibes] for vibe in vibes], dtype=bool)
+        vibe_scores = np.where(keyword_matches, np.maximum(vibe_scores, 0.7), vibe_scores)
+        
+        # Places without any types do not match
+        has_types = np.array([bool(place.get('types')) for place in places])
+        
+        return np.where(has_types, vibe_scores.sum(axis=0) / len(vibes), 0.0)  # Average score across all vibes
+    
+    def _calculate_quality_scores(self, ratings: np.ndarray, review_counts: np.ndarray) -> np.ndarray:
+        """Calculate quality scores based on ratings and review counts."""
         # Normalize rating to 0-1 scale
-        rating_score = rating / 5.0
+        rating_scores = ratings / 5.0
         
         # Normalize review count (log scale to handle wide range)
-        review_score = min(1.0, math.log(max(review_count, 1)) / math.log(1000))
+        review_scores = np.minimum(1.0, np.log(np.maximum(review_counts, 1)) / math.log(1000))
         
         # Weighted combination (rating more important than review count)
-        return rating_score * 0.7 + review_score * 0.3
+        return rating_scores * 0.7 + review_scores * 0.3
     
-    def _calculate_proximity_score(self, place: Dict[str, Any], vibes: List[str]) -> float:
-        """Calculate proximity score (simplified for MVP - could be enhanced with actual distance calculations)"""
-        # For MVP, we'll use a simple heuristic based on coordinates
-        # In production, this would calculate actual walking distances
-        
-        # Base score - we want places that are reasonably close together
-        base_score = 0.5
+    def _calculate_proximity_scores(self, places: List[Dict[str, Any]], neighbor_quality: np.ndarray,
+                                    origin: Optional[Tuple[float, float]] = None) -> np.ndarray:
+        """
+        Calculate proximity scores for all candidates from their coordinates.
         
-        # Could be enhanced with actual distance calculations between places
-        # For now, return base score
-        return base_score
+        Half of the score decays with distance to the user (or to the candidates'
+        centroid when no origin is given); the other half rewards having strong
+        candidates close by, weighted by their non-proximity score `neighbor_quality`.
+        Places without coordinates keep the neutral score of 0.5.
+        """
+        lats, lngs = self._get_coordinates(places)
+        located = ~np.isnan(lats)
+        scores = np.full(len(places), 0.5)
+        if not located.any():
+            return scores
+        
+        lats, lngs = lats[located], lngs[located]
+        
+        # Distance to the user
+        if origin is not None:
+            origin_lat, origin_lng = origin
+        else:
+            origin_lat, origin_lng = float(lats.mean()), float(lngs.mean())
+        user_score = np.exp(-haversine_distances(origin_lat, origin_lng, lats, lngs) / self.user_distance_scale)
+        
+        # Density of nearby high-scoring neighbors
+        weights = np.exp(-haversine_matrix(lats, lngs) / self.neighbor_distance_scale)
+        np.fill_diagonal(weights, 0.0)
+        density_score = 1.0 - np.exp(-(weights @ neighbor_quality[located]))
+        
+        scores[located] = 0.5 * user_score + 0.5 * density_score
+        return scores
     
-    def _calculate_hidden_gem_score(self, place: Dict[str, Any]) -> float:
-        """Calculate hidden gem score - boost for highly-rated but less-reviewed places."""
-        rating = place.get('rating', 0)
-        review_count = place.get('user_ratings_total', 0)
-        
+    def _calculate_hidden_gem_scores(self, ratings: np.ndarray, review_counts: np.ndarray) -> np.ndarray:
+        """Calculate hidden gem scores - boost for highly-rated but less-reviewed places."""
         # High rating with fewer reviews suggests a hidden gem
-        if rating >= 4.5 and review_count < 200:
-            return 0.8
-        elif rating >= 4.0 and review_count < 100:
-            return 0.6
-        elif rating >= 4.5 and review_count < 500:
-            return 0.4
-        
-        return 0.0
+        return np.select(
+            [
+                (ratings >= 4.5) & (review_counts < 200),
+                (ratings >= 4.0) & (review_counts < 100),
+                (ratings >= 4.5) & (review_counts < 500)
+            ],
+            [0.8, 0.6, 0.4],
+            default=0.0
+        )
     
     def _get_vibe_keywords(self, vibe: str) -> List[str]:
         """Get relevant keywords for a vibe."""
-        keywords = {
-            'cozy': ['cozy', 'quiet', 'peaceful', 'comfortable', 'warm'],
-            'artsy': ['art', 'creative', 'artistic', 'design', 'craft'],
-            'historic': ['historic', 'old', 'classic', 'traditional', 'heritage'],
-            'trendy': ['trendy', 'modern', 'hip', 'contemporary', 'stylish'],
-            'nature': ['nature', 'outdoor', 'green', 'natural', 'park'],
-            'foodie': ['food', 'culinary', 'gourmet', 'restaurant', 'dining'],
-            'nightlife': ['night', 'evening', 'vibrant', 'energetic', 'lively'],
-            'hidden': ['hidden', 'secret', 'local', 'neighborhood', 'gem']
-        }
-        return keywords.get(vibe, [])
+        return self.vibe_keywords.get(vibe, [])
     
-    def _optimize_trail_walkability(self, scored_places: List[ScoredPlace]) -> List[ScoredPlace]:
-        """Optimize the trail for walkability by selecting places that form a logical route."""
-        if len(scored_places) <= 4:
-            return scored_places[:4]
+    def _compile_keyword_matcher(self):
+        """
+        Compile every vibe keyword into one regex so a name is scanned once for all vibes.
+        
+        The pattern is a zero-width lookahead tried at every position, so overlapping
+        matches are found. Alternatives are ordered longest first, so at each position
+        the longest keyword wins; any shorter keyword matching there is a prefix of it,
+        which is why each keyword maps to the vibes of all its keyword prefixes.
+        """
+        keyword_vibes: Dict[str, set] = {}
+        for vibe, keywords in self.vibe_keywords.items():
+            for keyword in keywords:
+                keyword_vibes.setdefault(keyword, set()).add(vibe)
+        
+        self._keyword_vibes = {
+            keyword: frozenset(vibe for other, vibes in keyword_vibes.items() if keyword.startswith(other) for vibe in vibes)
+            for keyword in keyword_vibes
+        }
+        alternatives = sorted(keyword_vibes, key=len, reverse=True)
+        self._keyword_pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in alternatives) + '))')
         
-        # For MVP, we'll use a simple approach: select top 4 places
-        # In production, this would implement actual route optimization algorithms
+        # Matched vibes per place, keyed by place_id and name
+        self._keyword_match_cache = TTLCache(max_entries=10000, ttl=86400)
+    
+    def _match_vibe_keywords(self, place: Dict[str, Any]) -> frozenset:
+        """Set of vibes whose keywords appear in the place name."""
+        name = place.get('name', '')
+        cache_key = (place.get('place_id'), name)
+        matched = self._keyword_match_cache.get(cache_key)
+        if matched is None:
+            matched = frozenset().union(
+                *(self._keyword_vibes[match.group(1)] for match in self._keyword_pattern.finditer(name.lower()))
+            )
+            self._keyword_match_cache.set(cache_key, matched)
+        return matched
+    
+    def _get_coordinates(self, places: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Latitude and longitude arrays for places, NaN where a place has no location."""
+        lats = np.full(len(places), np.nan)
+        lngs = np.full(len(places), np.nan)
+        for i, place in enumerate(places):
+            location = place.get('geometry', {}).get('location', {})
+            if 'lat' in location and 'lng' in location:
+                lats[i] = location['lat']
+                lngs[i] = location['lng']
+        return lats, lngs
+    
+    def _distance_matrix(self, places: List[Dict[str, Any]]) -> np.ndarray:
+        """Pairwise walking distances in meters; pairs involving unlocated places get the worst known distance."""
+        lats, lngs = self._get_coordinates(places)
+        return self._fill_missing_distances(self.walking_estimator.distance_matrix(lats, lngs))
+    
+    def _fill_missing_distances(self, matrix: np.ndarray) -> np.ndarray:
+        """Replace unknown (NaN) distances with the worst known one so such places are avoided, not chosen."""
+        if np.isnan(matrix).any():
+            worst = np.nanmax(matrix) if not np.isnan(matrix).all() else self.max_walk_distance
+            matrix = np.nan_to_num(matrix, nan=worst)
+            np.fill_diagonal(matrix, 0.0)
+        return matrix
+    
+    def _optimize_trail_walkability(self, scored_places: List[ScoredPlace], origin: Optional[Tuple[float, float]] = None,
+                                    distance_matrix: Optional[np.ndarray] = None) -> Tuple[List[ScoredPlace], List[float]]:
+        """
+        Optimize the trail for walkability by selecting places that form a logical route.
         
-        selected = scored_places[:4]
+        Treats selection as a small orienteering problem over the top of the
+        ranking: maximize total score with at most `trail_size` stops whose walk
+        fits `max_walk_distance`, visited in the shortest order. Small pools are
+        searched exactly; larger ones use greedy insertion with 2-opt and swap
+        moves. The search stops at `optimizer_time_budget` with the best route so far.
         
-        # Simple optimization: try to ensure variety in place types
-        place_types = set()
-        optimized_selection = []
+        Returns:
+            The selected places in visiting order and the distance of each leg
+        """
+        pool = scored_places[:self.optimizer_pool_size]
+        if len(pool) <= 1:
+            return pool, []
+        
+        deadline = time.perf_counter() + self.optimizer_time_budget
+        if distance_matrix is None:
+            distance_matrix = self._distance_matrix([scored_place.place for scored_place in pool])
+        dist = distance_matrix.tolist()
+        scores = [scored_place.score for scored_place in pool]
+        k = min(self.trail_size, len(pool))
+        
+        order = None
+        if len(pool) <= self.exact_search_limit:
+            order = self._exact_route_search(scores, dist, k, deadline)
+        if order is None:
+            order = self._greedy_route_search(scores, dist, k, deadline)
+        
+        # Start the walk from the end of the route closest to the user
+        if origin is not None and len(order) > 1:
+            lats, lngs = self._get_coordinates([pool[order[0]].place, pool[order[-1]].place])
+            to_start, to_end = haversine_distances(origin[0], origin[1], lats, lngs)
+            if to_end < to_start:
+                order.reverse()
+        
+        leg_distances = [dist[a][b] for a, b in zip(order, order[1:])]
+        return [pool[i] for i in order], leg_distances
+    
+    def _path_length(self, order: List[int], dist: List[List[float]]) -> float:
+        return sum(dist[a][b] for a, b in zip(order, order[1:]))
+    
+    def _cheapest_insertion(self, order: List[int], candidate: int, dist: List[List[float]]) -> Tuple[float, int]:
+        """Smallest added path length for inserting a candidate into an open path, and where."""
+        if not order:
+            return 0.0, 0
+        
+        best_delta, best_position = dist[candidate][order[0]], 0
+        end_delta = dist[order[-1]][candidate]
+        if end_delta < best_delta:
+            best_delta, best_position = end_delta, len(order)
+        
+        for position in range(1, len(order)):
+            a, b = order[position - 1], order[position]
+            delta = dist[a][candidate] + dist[candidate][b] - dist[a][b]
+            if delta < best_delta:
+                best_delta, best_position = delta, position
+        
+        return best_delta, best_position
+    
+    def _shortest_open_path(self, stops: Tuple[int, ...], dist: List[List[float]]) -> Tuple[float, List[int]]:
+        """Exact shortest visiting order for a handful of stops."""
+        best_length, best_order = float('inf'), list(stops)
+        for permutation in itertools.permutations(stops):
+            if permutation[0] > permutation[-1]:
+                continue  # a reversed path has the same length
+            length = self._path_length(permutation, dist)
+            if length < best_length:
+                best_length, best_order = length, list(permutation)
+        return best_length, best_order
+    
+    def _two_opt(self, order: List[int], dist: List[List[float]], deadline: float) -> List[int]:
+        """Improve an open path by reversing segments while that shortens it."""
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            length = self._path_length(order, dist)
+            for i in range(len(order) - 1):
+                for j in range(i + 1, len(order)):
+                    candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                    candidate_length = self._path_length(candidate, dist)
+                    if candidate_length < length - 1e-9:
+                        order, length, improved = candidate, candidate_length, True
+        return order
+    
+    def _exact_route_search(self, scores: List[float], dist: List[List[float]], k: int, deadline: float) -> Optional[List[int]]:
+        """
+        Exhaustive search over stop combinations, best total score first.
         
-        for place in selected:
-            place_types.update(place.place.get('types', []))
-            optimized_selection.append(place)
+        The first combination whose shortest path fits the budget is optimal.
+        Returns None if nothing fits or the time budget runs out.
+        """
+        for size in range(k, min(self.min_trail_size, k) - 1, -1):
+            combinations = sorted(
+                itertools.combinations(range(len(scores)), size),
+                key=lambda combination: sum(scores[i] for i in combination),
+                reverse=True
+            )
+            for combination in combinations:
+                if time.perf_counter() > deadline:
+                    return None
+                length, order = self._shortest_open_path(combination, dist)
+                if length <= self.max_walk_distance:
+                    return order
+        return None
+    
+    def _greedy_route_search(self, scores: List[float], dist: List[List[float]], k: int, deadline: float) -> List[int]:
+        """
+        Greedy insertion by score per added meter, then 2-opt and swap local search.
         
-        return optimized_selection
+        When the area is too spread out for the budget, stops are still added up
+        to `min_trail_size` at the cheapest positions so the trail is never too short.
+        """
+        order = [0]
+        while len(order) < k:
+            length = self._path_length(order, dist)
+            best = None
+            for candidate in range(len(scores)):
+                if candidate in order:
+                    continue
+                delta, position = self._cheapest_insertion(order, candidate, dist)
+                feasible = length + delta <= self.max_walk_distance
+                if not feasible and len(order) >= self.min_trail_size:
+                    continue
+                key = (feasible, scores[candidate] / (delta + 50.0))
+                if best is None or key > best[0]:
+                    best = (key, candidate, position)
+            if best is None:
+                break
+            order.insert(best[2], best[1])
+        
+        order = self._two_opt(order, dist, deadline)
+        
+        # Swap a selected stop for a higher-scoring unselected one while the route still fits
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            limit = max(self.max_walk_distance, self._path_length(order, dist))
+            for i, current in enumerate(order):
+                for candidate in range(len(scores)):
+                    if candidate in order or scores[candidate] <= scores[current]:
+                        continue
+                    swapped = order[:i] + order[i + 1:]
+                    _, position = self._cheapest_insertion(swapped, candidate, dist)
+                    swapped.insert(position, candidate)
+                    swapped = self._two_opt(swapped, dist, deadline)
+                    if self._path_length(swapped, dist) <= limit:
+                        order, improved = swapped, True
+                        break
+                if improved:
+                    break
+        
+        return order
     
     def _format_places_for_response(self, scored_places: List[ScoredPlace]) -> List[Dict[str, Any]]:
         """Format the selected places for API response."""
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from .cache import TTLCache
+from .geo import geohash_encode, geohash_center
+from .single_flight import SingleFlight
+
+TrailGenerator = Callable[[List[str], float, float], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class TrailOfTheDayService:
+    """
+    Precomputed trails per (geohash tile, vibe) for the most requested areas.
+
+    Every trail request is counted against its tile and vibe. A background loop
+    generates trails for the hottest (tile, vibe) pairs at the tile centre and
+    refreshes them once they are older than `fresh_ttl`. Reads are
+    stale-while-revalidate: a stale trail is still served (up to `max_stale`
+    past freshness) while a refresh runs in the background.
+
+    Trails generated on a miss for keys that are not hot go to a separate,
+    smaller on-demand store, so requests for arbitrary tiles cannot evict the
+    precomputed hot trails.
+    """
+
+    def __init__(self, generate_trail: TrailGenerator):
+        self.generate_trail = generate_trail
+
+        self.tile_precision = int(os.getenv('TRAIL_OF_THE_DAY_PRECISION', '6'))
+        self.fresh_ttl = float(os.getenv('TRAIL_OF_THE_DAY_TTL', '86400'))
+        self.max_stale = float(os.getenv('TRAIL_OF_THE_DAY_MAX_STALE', '172800'))
+        self.refresh_interval = float(os.getenv('TRAIL_OF_THE_DAY_REFRESH_INTERVAL', '3600'))
+        self.max_hot_keys = int(os.getenv('TRAIL_OF_THE_DAY_MAX_TILES', '50'))
+        self.min_requests = int(os.getenv('TRAIL_OF_THE_DAY_MIN_REQUESTS', '3'))
+
+        # Trails are stored as {'trail', 'generated_at'} and dropped once too stale to serve
+        self.store = TTLCache(max_entries=self.max_hot_keys * 4, ttl=self.fresh_ttl + self.max_stale)
+        self.on_demand = TTLCache(
+            max_entries=int(os.getenv('TRAIL_OF_THE_DAY_ON_DEMAND_MAX_ENTRIES', '100')),
+            ttl=self.fresh_ttl
+        )
+        self.store_path = os.getenv('TRAIL_OF_THE_DAY_PATH')
+        if self.store_path:
+            try:
+                self.store.load(self.store_path)
+            except Exception as e:
+                print(f"Warning: Failed to load trails of the day from {self.store_path}: {e}")
+
+        # Decayed request counts per "tile:vibe"
+        self.demand: Dict[str, float] = {}
+        self.single_flight = SingleFlight()
+        self._refresh_tasks: set = set()
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the background materialization loop. Called from the app lifespan."""
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._materialize_loop())
+
+    async def close(self):
+        """Stop background work and persist the store if a path is configured."""
+        tasks = list(self._refresh_tasks)
+        if self._loop_task is not None:
+            tasks.append(self._loop_task)
+            self._loop_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.store_path:
+            try:
+                self.store.save(self.store_path)
+            except Exception as e:
+                print(f"Warning: Failed to save trails of the day to {self.store_path}: {e}")
+
+    def tile_key(self, lat: float, lng: float, vibe: str) -> str:
+        return f"{geohash_encode(lat, lng, self.tile_precision)}:{vibe}"
+
+    def record_request(self, lat: float, lng: float, vibes: List[str]):
+        """Count a trail request towards its tile's demand for each requested vibe."""
+        for vibe in vibes:
+            key = self.tile_key(lat, lng, vibe)
+            self.demand[key] = self.demand.get(key, 0.0) + 1.0
+
+    def get_cached(self, lat: float, lng: float, vibe: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """
+        The stored trail for the tile and vibe and whether it is fresh, or None.
+        A stale hit schedules a background refresh.
+        """
+        key = self.tile_key(lat, lng, vibe)
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+
+        fresh = time.time() - entry['generated_at'] < self.fresh_ttl
+        if not fresh:
+            self._schedule_refresh(key)
+        return entry['trail'], fresh
+
+    async def get_trail(self, lat: float, lng: float, vibe: str) -> Optional[Dict[str, Any]]:
+        """The trail for the tile and vibe, generating it now if nothing is stored yet."""
+        cached = self.get_cached(lat, lng, vibe)
+        if cached is not None:
+            return cached[0]
+
+        key = self.tile_key(lat, lng, vibe)
+        if key in self._hot_keys():
+            return await self.refresh(key)
+
+        entry = self.on_demand.get(key)
+        if entry is not None:
+            return entry['trail']
+        return await self.single_flight.do(key, lambda: self._generate(key, self.on_demand))
+
+    async def refresh(self, key: str) -> Optional[Dict[str, Any]]:
+        """Generate and store the trail for a "tile:vibe" key; concurrent refreshes share one run."""
+        return await self.single_flight.do(key, lambda: self._generate(key, self.store))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.store.stats(),
+            'on_demand_entries': len(self.on_demand),
+            'tracked_keys': len(self.demand),
+            'refreshing': len(self._refresh_tasks)
+        }
+
+    async def _generate(self, key: str, store: TTLCache) -> Optional[Dict[str, Any]]:
+        tile, vibe = key.split(':', 1)
+        lat, lng = geohash_center(tile)
+        try:
+            trail = await self.generate_trail([vibe], lat, lng)
+        except Exception as e:
+            print(f"Error materializing trail for {key}: {e}")
+            return None
+
+        if trail:
+            store.set(key, {'trail': trail, 'generated_at': time.time()})
+        return trail
+
+    def _schedule_refresh(self, key: str):
+        task = asyncio.create_task(self.refresh(key))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    def _hot_keys(self) -> List[str]:
+        ranked = heapq.nlargest(self.max_hot_keys, self.demand.items(), key=lambda item: item[1])
+        return [key for key, count in ranked if count >= self.min_requests]
+
+    async def _materialize_loop(self):
+        """Refresh missing or aging trails for the hottest keys, then decay demand."""
+        while True:
+            for key in self._hot_keys():
+                entry = self.store.get(key)
+                if entry is None:
+                    # A key that just turned hot keeps the trail it was served on demand
+                    entry = self.on_demand.get(key)
+                    if entry is not None:
+                        self.store.set(key, entry)
+                        self.on_demand.delete(key)
+                # Refresh a little ahead of expiry so hot keys are rarely served stale
+                if entry is None or time.time() - entry['generated_at'] >= self.fresh_ttl - self.refresh_interval:
+                    await self.refresh(key)
+
+            # Halve counts each cycle so demand reflects recent traffic, and forget cold keys
+            self.demand = {key: count / 2 for key, count in self.demand.items() if count / 2 >= 0.5}
+
+            await asyncio.sleep(self.refresh_interval)
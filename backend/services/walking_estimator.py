@@ -0,0 +1,231 @@
+import heapq
+import math
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from .geo import EARTH_RADIUS_METERS, haversine_distances, haversine_matrix
+
+
+class WalkingEstimator:
+    """
+    Offline walking distance and time estimates, no network needed.
+
+    By default distances are great-circle distances scaled by a street-network
+    detour factor. When WALKING_GRAPH_PATH points to a preprocessed street graph
+    (an .npz with node `lat`/`lng` arrays and a CSR adjacency `indptr`/`indices`/
+    `weights` in meters, e.g. built from an OSM extract), legs are routed on the
+    graph with A* and matrices with one bounded Dijkstra per source. Points that
+    cannot be snapped to the graph, pairs it cannot connect, legs whose search
+    exceeds WALKING_GRAPH_MAX_SEARCH_NODES and matrix rows not reached within
+    WALKING_GRAPH_MATRIX_BUDGET_MS fall back to the detour estimate.
+    """
+
+    def __init__(self):
+        self.detour_factor = float(os.getenv('WALKING_DETOUR_FACTOR', '1.3'))
+        self.walking_speed = float(os.getenv('WALKING_SPEED_MPS', '1.4'))
+        self.max_snap_distance = float(os.getenv('WALKING_GRAPH_MAX_SNAP_METERS', '250'))
+        self.matrix_time_budget = float(os.getenv('WALKING_GRAPH_MATRIX_BUDGET_MS', '150')) / 1000
+        self.max_search_nodes = int(os.getenv('WALKING_GRAPH_MAX_SEARCH_NODES', '20000'))
+
+        self.node_lats: Optional[np.ndarray] = None
+        self.node_lngs: Optional[np.ndarray] = None
+        self.indptr: Optional[np.ndarray] = None
+        self.indices: Optional[np.ndarray] = None
+        self.weights: Optional[np.ndarray] = None
+
+        graph_path = os.getenv('WALKING_GRAPH_PATH')
+        if graph_path:
+            try:
+                self.load_graph(graph_path)
+                print(f"Loaded walking graph with {len(self.node_lats)} nodes from {graph_path}")
+            except Exception as e:
+                print(f"Warning: could not load walking graph from {graph_path}: {e}")
+
+    @property
+    def has_graph(self) -> bool:
+        return self.indptr is not None
+
+    def load_graph(self, path: str):
+        """Load a CSR street graph from an .npz file."""
+        with np.load(path) as graph:
+            node_lats = np.asarray(graph['lat'], dtype=float)
+            node_lngs = np.asarray(graph['lng'], dtype=float)
+            indptr = np.asarray(graph['indptr'], dtype=np.int64)
+            indices = np.asarray(graph['indices'], dtype=np.int64)
+            weights = np.asarray(graph['weights'], dtype=float)
+
+        if len(indptr) != len(node_lats) + 1 or len(indices) != len(weights) or indptr[-1] != len(indices):
+            raise ValueError("malformed CSR graph")
+
+        self.node_lats, self.node_lngs = node_lats, node_lngs
+        self.indptr, self.indices, self.weights = indptr, indices, weights
+        # Plain lists are much faster than numpy slices inside the search loops
+        self._indptr_list, self._indices_list, self._weights_list = indptr.tolist(), indices.tolist(), weights.tolist()
+        # Node coordinates in radians for the scalar A* heuristic
+        self._lat_radians = np.radians(node_lats).tolist()
+        self._lng_radians = np.radians(node_lngs).tolist()
+
+    def distance_matrix(self, lats, lngs) -> np.ndarray:
+        """
+        Pairwise walking distances in meters. Pairs involving NaN coordinates stay NaN.
+        Graph search stops at `matrix_time_budget`; unfinished pairs keep the detour estimate.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        matrix = haversine_matrix(lats, lngs) * self.detour_factor
+        if not self.has_graph or len(lats) < 2:
+            return matrix
+
+        deadline = time.perf_counter() + self.matrix_time_budget
+        snapped = self._snap(lats, lngs)
+        targets = {}
+        for j, (node, _) in enumerate(snapped):
+            if node is not None:
+                targets.setdefault(node, []).append(j)
+
+        routed = np.zeros(matrix.shape, dtype=bool)
+        for i, (source, source_offset) in enumerate(snapped):
+            if source is None:
+                continue
+            if time.perf_counter() >= deadline:
+                print(f"Walking graph matrix budget exhausted after {i} of {len(snapped)} rows")
+                break
+            # Nothing farther than the straight-line estimate times a generous margin is worth exploring
+            cutoff = np.nanmax(matrix[i]) * 2 if not np.isnan(matrix[i]).all() else 0.0
+            settled = self._dijkstra(source, set(targets), cutoff, deadline)
+            for node, distance in settled.items():
+                for j in targets[node]:
+                    if j != i:
+                        matrix[i, j] = source_offset + distance + snapped[j][1]
+                        routed[i, j] = True
+
+        # Walking graphs are undirected, so a routed pair covers its unrouted reverse
+        reverse = routed.T & ~routed
+        matrix[reverse] = matrix.T[reverse]
+        return matrix
+
+    def leg_distance(self, start: Tuple[float, float], end: Tuple[float, float]) -> float:
+        """Walking distance in meters between two (lat, lng) points."""
+        estimate = float(haversine_distances(start[0], start[1], [end[0]], [end[1]])[0]) * self.detour_factor
+        if not self.has_graph:
+            return estimate
+
+        (source, source_offset), (target, target_offset) = self._snap([start[0], end[0]], [start[1], end[1]])
+        if source is None or target is None:
+            return estimate
+
+        distance = self._a_star(source, target)
+        if distance is None:
+            return estimate
+        return source_offset + distance + target_offset
+
+    def duration(self, distance: float) -> float:
+        """Walking time in seconds for a distance in meters."""
+        return distance / self.walking_speed
+
+    def estimate_route(self, coordinates: List[Dict[str, float]]) -> Dict[str, Any]:
+        """Directions for a series of coordinates, in the same shape as MapboxDirectionsService results."""
+        leg_distances = [
+            self.leg_distance((start['lat'], start['lng']), (end['lat'], end['lng']))
+            for start, end in zip(coordinates, coordinates[1:])
+        ]
+        polyline = [[coord['lng'], coord['lat']] for coord in coordinates]
+        total_distance = sum(leg_distances)
+
+        return {
+            "geometry": {
+                "type": "LineString",
+                "coordinates": polyline
+            },
+            "duration": int(round(self.duration(total_distance))),
+            "distance": int(round(total_distance)),
+            "steps": [
+                {
+                    "instruction": f"Walk to {coordinates[i+1].get('name', f'Stop {i+2}')}",
+                    "distance": int(round(distance)),
+                    "duration": int(round(self.duration(distance))),
+                    "type": "continue"
+                }
+                for i, distance in enumerate(leg_distances)
+            ],
+            "polyline": polyline
+        }
+
+    def _snap(self, lats, lngs) -> List[Tuple[Optional[int], float]]:
+        """Nearest graph node and its distance for each point, or (None, 0) when too far or unlocated."""
+        snapped = []
+        for lat, lng in zip(lats, lngs):
+            if np.isnan(lat) or np.isnan(lng):
+                snapped.append((None, 0.0))
+                continue
+            distances = haversine_distances(lat, lng, self.node_lats, self.node_lngs)
+            node = int(np.argmin(distances))
+            if distances[node] > self.max_snap_distance:
+                snapped.append((None, 0.0))
+            else:
+                snapped.append((node, float(distances[node])))
+        return snapped
+
+    def _neighbors(self, node: int):
+        start, end = self._indptr_list[node], self._indptr_list[node + 1]
+        return zip(self._indices_list[start:end], self._weights_list[start:end])
+
+    def _a_star(self, source: int, target: int) -> Optional[float]:
+        """
+        Shortest graph distance with a great-circle heuristic, or None if unreachable
+        or not found within `max_search_nodes` expanded nodes.
+        """
+        lat_radians, lng_radians = self._lat_radians, self._lng_radians
+        target_lat, target_lng = lat_radians[target], lng_radians[target]
+        cos_target_lat = math.cos(target_lat)
+
+        def heuristic(node: int) -> float:
+            a = (math.sin((lat_radians[node] - target_lat) / 2) ** 2
+                 + math.cos(lat_radians[node]) * cos_target_lat * math.sin((lng_radians[node] - target_lng) / 2) ** 2)
+            return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(min(1.0, a)))
+
+        best = {source: 0.0}
+        queue = [(heuristic(source), 0.0, source)]
+        expanded = 0
+        while queue:
+            _, distance, node = heapq.heappop(queue)
+            if node == target:
+                return distance
+            if distance > best.get(node, float('inf')):
+                continue
+            expanded += 1
+            if expanded > self.max_search_nodes:
+                return None
+            for neighbor, weight in self._neighbors(node):
+                candidate = distance + weight
+                if candidate < best.get(neighbor, float('inf')):
+                    best[neighbor] = candidate
+                    heapq.heappush(queue, (candidate + heuristic(neighbor), candidate, neighbor))
+        return None
+
+    def _dijkstra(self, source: int, targets: set, cutoff: float, deadline: Optional[float] = None) -> Dict[int, float]:
+        """Graph distances from source to the targets it reaches within cutoff meters (and before deadline)."""
+        remaining = set(targets)
+        settled = {}
+        best = {source: 0.0}
+        queue = [(0.0, source)]
+        popped = 0
+        while queue and remaining:
+            distance, node = heapq.heappop(queue)
+            popped += 1
+            if deadline is not None and popped % 512 == 0 and time.perf_counter() >= deadline:
+                break
+            if distance > best.get(node, float('inf')):
+                continue
+            if distance > cutoff:
+                break
+            if node in remaining:
+                remaining.discard(node)
+                settled[node] = distance
+            for neighbor, weight in self._neighbors(node):
+                candidate = distance + weight
+                if candidate < best.get(neighbor, float('inf')):
+                    best[neighbor] = candidate
+                    heapq.heappush(queue, (candidate, neighbor))
+        return settled
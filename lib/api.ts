@@ -1,4 +1,4 @@
-import { TrailRequest, VibeTrail } from '@/types'
+import { TrailRequest, TrailRoute, TrailStop, VibeTrail } from '@/types'
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
@@ -30,6 +30,73 @@ export async function generateTrail(request: TrailRequest): Promise<VibeTrail> {
   }
 }
 
+// Precomputed trail for the area around a location; the vibe rotates daily when omitted
+export async function getTrailOfTheDay(
+  latitude: number,
+  longitude: number,
+  vibe?: string
+): Promise<VibeTrail & { vibe: string }> {
+  const params = new URLSearchParams({ latitude: String(latitude), longitude: String(longitude) })
+  if (vibe) {
+    params.set('vibe', vibe)
+  }
+
+  const response = await fetch(`${API_BASE_URL}/trail-of-the-day?${params}`)
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`)
+  }
+  return response.json()
+}
+
+export type TrailStreamEvent =
+  | { event: 'stops'; stops: TrailStop[]; route?: TrailRoute; trail_token?: string }
+  | { event: 'narrative'; narrative: VibeTrail['narrative'] }
+  | { event: 'directions'; directions: any }
+  | { event: 'error'; detail: string }
+  | { event: 'done' }
+
+// Streams a trail as newline-delimited JSON: stops arrive first, then the
+// narrative and walking directions as soon as each is ready
+export async function generateTrailStream(
+  request: TrailRequest,
+  onEvent: (event: TrailStreamEvent) => void
+): Promise<void> {
+  const response = await fetch(`${API_BASE_URL}/generate-trail/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(request),
+  })
+
+  if (!response.ok || !response.body) {
+    throw new Error(`HTTP error! status: ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+
+    buffer += decoder.decode(value, { stream: true })
+    const lines = buffer.split('\n')
+    buffer = lines.pop() || ''
+
+    for (const line of lines) {
+      if (line.trim()) {
+        onEvent(JSON.parse(line))
+      }
+    }
+  }
+
+  if (buffer.trim()) {
+    onEvent(JSON.parse(buffer))
+  }
+}
+
 export async function regenerateStop(
   vibes: string[],
   latitude: number,
@@ -1,5 +1,6 @@
 -- Enable necessary extensions
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+CREATE EXTENSION IF NOT EXISTS postgis;
 
 -- Create profiles table
 CREATE TABLE IF NOT EXISTS profiles (
@@ -19,10 +20,39 @@ CREATE TABLE IF NOT EXISTS saved_trails (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Summary columns for trail listings, derived from trail_data so listings never read the JSONB blob
+ALTER TABLE saved_trails
+    ADD COLUMN IF NOT EXISTS title TEXT
+        GENERATED ALWAYS AS (trail_data->'narrative'->>'title') STORED,
+    ADD COLUMN IF NOT EXISTS stop_count INTEGER
+        GENERATED ALWAYS AS (jsonb_array_length(COALESCE(trail_data->'stops', '[]'::jsonb))) STORED,
+    ADD COLUMN IF NOT EXISTS first_stop_lat DOUBLE PRECISION
+        GENERATED ALWAYS AS ((trail_data->'stops'->0->'geometry'->'location'->>'lat')::double precision) STORED,
+    ADD COLUMN IF NOT EXISTS first_stop_lng DOUBLE PRECISION
+        GENERATED ALWAYS AS ((trail_data->'stops'->0->'geometry'->'location'->>'lng')::double precision) STORED,
+    -- Where the trail starts, for spatial search (generated columns cannot reference each other)
+    ADD COLUMN IF NOT EXISTS start_location GEOGRAPHY(POINT, 4326)
+        GENERATED ALWAYS AS (
+            ST_SetSRID(ST_MakePoint(
+                (trail_data->'stops'->0->'geometry'->'location'->>'lng')::double precision,
+                (trail_data->'stops'->0->'geometry'->'location'->>'lat')::double precision
+            ), 4326)::geography
+        ) STORED;
+
+-- Sharing and popularity, for reusing other users' trails
+ALTER TABLE saved_trails
+    ADD COLUMN IF NOT EXISTS is_public BOOLEAN NOT NULL DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0;
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_saved_trails_user_id ON saved_trails(user_id);
 CREATE INDEX IF NOT EXISTS idx_saved_trails_created_at ON saved_trails(created_at);
 CREATE INDEX IF NOT EXISTS idx_saved_trails_vibes ON saved_trails USING GIN(vibes);
+-- Keyset pagination of a user's trails: WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_saved_trails_user_created ON saved_trails(user_id, created_at DESC, id DESC);
+-- Spatial search: all trails for their owners, public trails for everyone
+CREATE INDEX IF NOT EXISTS idx_saved_trails_start_location ON saved_trails USING GIST(start_location);
+CREATE INDEX IF NOT EXISTS idx_saved_trails_public_start_location ON saved_trails USING GIST(start_location) WHERE is_public;
 
 -- Create function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -69,6 +99,42 @@ CREATE POLICY "Users can update own saved trails" ON saved_trails
 CREATE POLICY "Users can delete own saved trails" ON saved_trails
     FOR DELETE USING (auth.uid() = user_id);
 
+CREATE POLICY "Anyone can view public saved trails" ON saved_trails
+    FOR SELECT USING (is_public);
+
+-- Search trails that start within p_radius_m meters of a point and share at least one vibe.
+-- Returns public trails plus the caller's own, most liked and best vibe match first.
+CREATE OR REPLACE FUNCTION search_trails(
+    p_vibes TEXT[],
+    p_lat DOUBLE PRECISION,
+    p_lng DOUBLE PRECISION,
+    p_radius_m DOUBLE PRECISION DEFAULT 1500,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    id UUID,
+    user_id UUID,
+    title TEXT,
+    vibes TEXT[],
+    stop_count INTEGER,
+    trail_data JSONB,
+    like_count INTEGER,
+    distance_m DOUBLE PRECISION,
+    created_at TIMESTAMP WITH TIME ZONE
+) AS $$
+    SELECT t.id, t.user_id, t.title, t.vibes, t.stop_count, t.trail_data, t.like_count,
+           ST_Distance(t.start_location, ST_SetSRID(ST_MakePoint(p_lng, p_lat), 4326)::geography) AS distance_m,
+           t.created_at
+    FROM saved_trails t
+    WHERE (t.is_public OR t.user_id = auth.uid())
+      AND t.vibes && p_vibes
+      AND ST_DWithin(t.start_location, ST_SetSRID(ST_MakePoint(p_lng, p_lat), 4326)::geography, p_radius_m)
+    ORDER BY cardinality(ARRAY(SELECT unnest(t.vibes) INTERSECT SELECT unnest(p_vibes))) DESC,
+             t.like_count DESC,
+             distance_m ASC
+    LIMIT LEAST(p_limit, 50);
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public, extensions;
+
 -- Create function to handle new user signup
 CREATE OR REPLACE FUNCTION handle_new_user()
 RETURNS TRIGGER AS $$
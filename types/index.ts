@@ -4,6 +4,15 @@ export interface VibeTrail {
     description: string
   }
   stops: TrailStop[]
+  route?: TrailRoute
+  trail_token?: string
+  reused_trail_id?: string
+}
+
+export interface TrailRoute {
+  order: string[]
+  leg_distances: number[]
+  total_distance: number
 }
 
 export interface TrailStop {
@@ -27,6 +36,7 @@ export interface TrailRequest {
   vibes: string[]
   latitude: number
   longitude: number
+  reuse_existing?: boolean
 }
 
 export interface VibeOption {